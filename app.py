@@ -1,210 +1,47 @@
 import streamlit as st
 import os
-import librosa
-import numpy as np
-import matplotlib.pyplot as plt
-import librosa.display
-import sounddevice as sd
-import soundfile as sf
-from collections import Counter
-from pydub import AudioSegment
-import matplotlib.cm as cm
-import io
+import base64
 import time
-import sqlite3
 
 # === Custom Modules (ensure these are consistent) ===
-from fingerprinting import preprocess_audio, get_peaks, generate_fingerprints
-from songs_db import load_songs, add_song
-from songs_lyrics import parse_artist_title, clean_lyrics, fetch_lyrics_genius
-from db_utils import song_in_db, add_song_to_db, add_fingerprints_bulk
-from build_database import build_database, convert_to_wav
+# Only light modules are imported at startup. librosa, matplotlib, sounddevice,
+# pydub and the recognition/ingest code are imported by the page that needs
+# them, so the first page renders without loading them ('python benchmark.py --startup').
+from songs_db import get_song
+from songs_lyrics import parse_artist_title, clean_lyrics, fetch_lyrics_genius, prefetch_lyrics
+from index_engine import INDEX_DIR
+from metrics import enable_json_log
+from result_cache import configure_result_cache
 
 # === Config & Constants ===
 SONG_FOLDER = "music_wavs"
 DB_FILE = "music_fingerprints.db"
 AUDIO_EXTS = (".mp3", ".m4a", ".flac", ".ogg", ".aac", ".wav", ".wma", ".opus", ".alac")
-N_FFT = 1024
-HOP_LENGTH = 512
-SR_QUERY = 8000
-FREQ_MIN = 32
-FREQ_MAX = 4096
+INDEX_ENGINE = "sqlite"  # "sqlite" or "mmap" (run 'python index_engine.py export' first)
+PROGRESSIVE = False  # look hashes up in rounds and stop once the match is clear (see recognition.py)
+QUERY_BUDGET_MS = None  # e.g. 300 to cap the time of a progressive recognition
+METRICS_LOG = None  # e.g. "recognition_metrics.jsonl" to log timings of every recognition as JSON lines
+RESULT_CACHE_SIZE = 256  # recognition results remembered for clips that are uploaded again
+RESULT_CACHE_FILE = None  # e.g. "recognition_cache.json" to keep them across restarts
 
 os.makedirs(SONG_FOLDER, exist_ok=True)
-
-# === Recognize Function (for SQLite) ===
-def parse_offset(db_offset):
-    if isinstance(db_offset, int):
-        return db_offset
-    if isinstance(db_offset, bytes):
-        return int.from_bytes(db_offset, byteorder="little", signed=True)
-    if isinstance(db_offset, str):
-        return int(db_offset)
-    raise ValueError(f"Unknown offset type: {type(db_offset)} - {db_offset}")
-
-def recognize(query_path, db_file=DB_FILE, show_benchmark=True):
-    # Start a timer to see how long the whole process takes (optional, for benchmarking)
-    t0 = time.perf_counter()
-    
-    # Load the audio file that we want to recognize.
-    # y = the audio data (like a long list of sound numbers), sr = sample rate (how many samples per second)
-    y, sr = librosa.load(query_path, sr=None, mono=True)
-    
-    # Preprocess the audio to make it easier to analyze (clean up, normalize, etc.)
-    y, sr = preprocess_audio(y, sr)
-    
-    # Find the most important frequency peaks in the audio. Peaks are like unique "sound events" in a song.
-    peaks = get_peaks(y, sr)
-    
-    # Convert those peaks into fingerprints (unique codes that represent moments in the song).
-    fingerprints = generate_fingerprints(peaks)
-    
-    # If no fingerprints could be created (maybe the audio is empty or too noisy), return nothing.
-    if not fingerprints:
-        # Let the caller (page) display info; just return None
-        return None, None
-    
-    # Make a dictionary to store, for each fingerprint hash, all the times (when it happens in the recording).
-    hash_to_times = {}
-    for h, t in fingerprints:
-        # If the hash is in bytes, decode it into a regular string (easier for the database)
-        if isinstance(h, bytes):
-            h = h.decode("utf-8")
-        # Store each time t for the same hash h (one hash may occur at different times)
-        hash_to_times.setdefault(h, []).append(t)
-    # Get a list of all the unique hashes we found in our audio snippet
-    hashes = list(hash_to_times.keys())
-
-    # This Counter will count how often a (song, offset) pairing occurs during the match
-    offset_counter = Counter()
-    BATCH = 900  # How many hashes to search at once (avoid asking the database for too much at a time)
-    
-    # Open a connection to the database where all song fingerprints are stored
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-    
-    # Make sure the database has an index on the hash column for fast searching
-    c.execute("CREATE INDEX IF NOT EXISTS idx_hash ON fingerprints(hash)")
-    t_db = time.perf_counter()  # Optional: checkpoint to see how long loading DB takes
-
-    # Search the database in chunks ("batches") to be more efficient
-    for i in range(0, len(hashes), BATCH):
-        # Take a slice of hashes for this batch
-        batch_hashes = hashes[i:i+BATCH]
-        # Make the right number of question marks for SQL (so we can use ? placeholders)
-        placeholders = ",".join("?" for _ in batch_hashes)
-        # Search the database: find all fingerprints whose hash is in our batch
-        c.execute(
-            f"SELECT hash, song_id, offset FROM fingerprints WHERE hash IN ({placeholders})",
-            batch_hashes
-        )
-        # For each match we found in the database...
-        for db_hash, song_id, db_offset in c.fetchall():
-            db_offset = parse_offset(db_offset)  # Sometimes the offset is not a number yet; fix it if needed
-            # For every time this hash was found in our query audio
-            for t in hash_to_times.get(db_hash, []):
-                # Count how many times the same song has the same time "difference" (offset) as our recording
-                # If many hashes line up at the same offset, it's a strong match!
-                offset_counter[(song_id, db_offset - t)] += 1
-
-    # If we didn't find any matches, close the DB and return nothing
-    if not offset_counter:
-        conn.close()
-        # Let the caller display info if needed
-        return None, None
-
-    # Find the (song_id, offset) with the most matches (the "winner")
-    (best_song_id, best_delta), match_count = offset_counter.most_common(1)[0]
-    
-    # Get the filename for the best matching song from the database
-    c.execute("SELECT filename FROM songs WHERE id=?", (best_song_id,))
-    row = c.fetchone()
-    conn.close()
-    t1 = time.perf_counter()
-
-    # If we found a result, return the song filename and the number of matches
-    if row:
-        # If caller wants, can access timing here
-        return row[0], match_count
-    # If something went wrong, return nothing
-    return None, None
-
-# === Caching for Spectrograms/Peaks ===
-@st.cache_data(show_spinner=False)
-def get_full_song_audio(song_path):
-    y, sr = librosa.load(song_path, sr=SR_QUERY, mono=True, duration=15)
-    y, sr = preprocess_audio(y, sr)
-    return y, sr
-
-@st.cache_data(show_spinner=False)
-def get_peaks_plot_data(song_path):
-    y, sr = librosa.load(song_path, sr=SR_QUERY, mono=True, duration=15)
-    y, sr = preprocess_audio(y, sr)
-    peaks = get_peaks(y, sr)
-    return y, sr, peaks
-
-# === Plotting Helpers ===
-def plot_debug_spectrogram_img_fast(y, sr, title="Spectrogram", progress_callback=None):
-    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
-    if progress_callback: progress_callback(40)
-    S_db = librosa.amplitude_to_db(S, ref=np.max)
-    if progress_callback: progress_callback(80)
-    fig, ax = plt.subplots(figsize=(8, 3))
-    librosa.display.specshow(S_db, sr=sr, hop_length=HOP_LENGTH, x_axis='time', y_axis='log', cmap='magma', ax=ax)
-    ax.set_title(title)
-    ax.set_ylim(FREQ_MIN, FREQ_MAX)
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi=120)
-    plt.close(fig)
-    buf.seek(0)
-    if progress_callback: progress_callback(100)
-    return buf
-
-def plot_spectrogram_peaks_connections_fast(
-        y, sr, peaks, fan_value=10, top_n=360, title="Spectrogram + Peaks + Connections"):
-    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
-    S_db = librosa.amplitude_to_db(S, ref=np.max)
-    fig, ax = plt.subplots(figsize=(8, 3))
-    librosa.display.specshow(S_db, sr=sr, hop_length=HOP_LENGTH, x_axis='time', y_axis='log', cmap='magma', ax=ax)
-    ax.set_title(title)
-    ax.set_ylim(FREQ_MIN, FREQ_MAX)
-    freqs = librosa.fft_frequencies(sr=sr, n_fft=N_FFT)
-    max_frame = S_db.shape[1]
-    peaks_plot = [p for p in peaks if p[1] < max_frame and p[0] < len(freqs)]
-    # Only top_n most powerful peaks for clarity
-    if len(peaks_plot) > 0:
-        peak_strengths = [S_db[f, t] for f, t in peaks_plot]
-        idx = np.argsort(peak_strengths)[-top_n:]
-        peaks_display = [peaks_plot[i] for i in idx]
-    else:
-        peaks_display = []
-    colors = cm.viridis(np.linspace(0, 1, max(len(peaks_display), 1)))
-    peaks_sorted = sorted(peaks_display, key=lambda x: x[1])
-    for i, (f1, t1) in enumerate(peaks_sorted):
-        color = colors[i]
-        for j in range(1, fan_value):
-            if i + j < len(peaks_sorted):
-                f2, t2 = peaks_sorted[i + j]
-                dt = t2 - t1
-                if 5 < dt <= 120:
-                    freq1 = freqs[f1]
-                    time1 = librosa.frames_to_time([t1], sr=sr, hop_length=HOP_LENGTH, n_fft=N_FFT)[0]
-                    freq2 = freqs[f2]
-                    time2 = librosa.frames_to_time([t2], sr=sr, hop_length=HOP_LENGTH, n_fft=N_FFT)[0]
-                    ax.plot([time1, time2], [freq1, freq2], color=color, alpha=0.22, linewidth=0.7, zorder=1)
-    if peaks_display:
-        times_idx = [p[1] for p in peaks_display]
-        freq_bins = [p[0] for p in peaks_display]
-        times = librosa.frames_to_time(times_idx, sr=sr, hop_length=HOP_LENGTH, n_fft=N_FFT)
-        freqs_plot = freqs[freq_bins]
-        ax.scatter(times, freqs_plot, color='cyan', s=26, zorder=2, edgecolors='black', linewidths=0.5)
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi=120)
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+if METRICS_LOG:
+    enable_json_log(METRICS_LOG)
+configure_result_cache(RESULT_CACHE_SIZE, RESULT_CACHE_FILE)
+
+# === Precomputed Pictures ===
+@st.cache_data(show_spinner="Preparing full-song spectrogram...")
+def render_missing_assets(song_path):
+    from song_assets import render_song_assets
+    return render_song_assets(song_path)
+
+def get_result_assets(filename):
+    from song_assets import get_song_assets
+    assets = get_song_assets(filename, DB_FILE)
+    if "spectrogram" not in assets or "constellation" not in assets:
+        # Song indexed before pictures were stored, 'python song_assets.py backfill' stores them for good
+        assets = render_missing_assets(os.path.join(SONG_FOLDER, filename))
+    return assets
 
 # === Session State True Reset ===
 def do_true_reset():
@@ -228,6 +65,33 @@ if st.session_state.get("do_reset", False):
 
 
 
+# === Performance Panel ===
+def show_performance_panel(query_path):
+    stats = st.session_state.get("recog_stats")
+    with st.expander("⏱️ Performance"):
+        if not stats:
+            st.info("No timings for this recognition (live mode recognizes while recording).")
+        else:
+            timings = dict(stats["timings"])
+            total = timings.pop("total", sum(timings.values()))
+            st.markdown(f"**Total: {total:.0f} ms**")
+            st.bar_chart({"ms": timings})
+            st.table({"Counter": list(stats["counters"].keys()), "Value": list(stats["counters"].values())})
+        if st.button("Profile this query (cProfile)", key="profile_query_btn"):
+            with st.spinner("Profiling..."):
+                from recognition import recognize
+                profiled = recognize(query_path, DB_FILE, engine=INDEX_ENGINE, index_dir=INDEX_DIR, profile=True,
+                                     progressive=PROGRESSIVE, budget_ms=QUERY_BUDGET_MS)
+            st.code(profiled["profile"])
+
+# === Adding Songs ===
+def show_ingest_result(song_id, song_name, ext):
+    if song_id:
+        st.success(f"✅ Added {song_name}{ext} to your database!")
+        st.info("Database updated!")
+    else:
+        st.warning("No fingerprints could be extracted from this song.")
+
 # === Page Functions ===
 def show_choose_page():
     # Title
@@ -259,30 +123,64 @@ def show_choose_page():
         add_btn = st.button("Add song to database 🎶", use_container_width=True)
         if uploaded_song and song_name and add_btn:
             ext = os.path.splitext(uploaded_song.name)[1].lower()
-            file_path = os.path.join(SONG_FOLDER, song_name + ".wav")
-            if ext == ".wav":
+            # Keep the original file, ingest decodes it once into the audio cache
+            file_path = os.path.join(SONG_FOLDER, song_name + ext)
+            if ext in AUDIO_EXTS:
                 with open(file_path, "wb") as f:
                     f.write(uploaded_song.read())
-            elif ext in AUDIO_EXTS:
-                temp_path = os.path.join(SONG_FOLDER, "temp_input" + ext)
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_song.read())
-                try:
-                    audio = AudioSegment.from_file(temp_path)
-                    audio.export(file_path, format="wav")
-                    os.remove(temp_path)
-                except Exception as e:
-                    st.error(f"Failed to convert uploaded file: {e}")
-                    os.remove(temp_path)
-                    file_path = None
             else:
                 st.error("Unsupported file format!")
                 file_path = None
             if file_path:
-                st.success(f"✅ Added {song_name}.wav to your database!")
-                add_song(song_name + ".wav", song_name, spotify_url)
-                build_database()
-                st.info("Database updated!")
+                from build_database import ingest_file, DuplicateSongError
+                # Fingerprint just this one file, no rescan of the whole song folder
+                try:
+                    with st.spinner("Fingerprinting the song..."):
+                        song_id = ingest_file(file_path, song_name, spotify_url, db_file=DB_FILE)
+                except DuplicateSongError as e:
+                    if e.overlap is None:
+                        # Same audio: keep the folder free of copies, a rebuild would only skip them again
+                        os.remove(file_path)
+                        existing = get_song(e.duplicate_of, DB_FILE).get("display_name", e.duplicate_of)
+                        st.warning(f"This song is already in your database as **{existing}**.")
+                    else:
+                        # Remixes and excerpts overlap too, the user decides below
+                        st.session_state["pending_duplicate"] = {
+                            "path": file_path, "name": song_name, "ext": ext, "spotify_url": spotify_url,
+                            "duplicate_of": e.duplicate_of, "overlap": e.overlap}
+                except Exception as e:
+                    st.error(f"Failed to fingerprint the song: {e}")
+                else:
+                    show_ingest_result(song_id, song_name, ext)
+
+        pending = st.session_state.get("pending_duplicate")
+        if pending:
+            existing = get_song(pending["duplicate_of"], DB_FILE).get("display_name", pending["duplicate_of"])
+            prompt = st.empty()
+            with prompt.container():
+                st.warning(f"This song sounds like **{existing}** ({pending['overlap']:.0%} of it lines up). "
+                           f"Is it another version, e.g. a remix or an excerpt?")
+                col_add, col_cancel = st.columns(2)
+                with col_add:
+                    add_anyway = st.button("Add anyway", key="add_duplicate", use_container_width=True)
+                with col_cancel:
+                    cancel = st.button("Don't add", key="cancel_duplicate", use_container_width=True)
+            if add_anyway or cancel:
+                prompt.empty()
+                del st.session_state["pending_duplicate"]
+            if cancel:
+                os.remove(pending["path"])
+                st.info("The song was not added.")
+            elif add_anyway:
+                from build_database import ingest_file
+                try:
+                    with st.spinner("Fingerprinting the song..."):
+                        song_id = ingest_file(pending["path"], pending["name"], pending["spotify_url"],
+                                              db_file=DB_FILE, skip_near_duplicates=False)
+                except Exception as e:
+                    st.error(f"Failed to fingerprint the song: {e}")
+                else:
+                    show_ingest_result(song_id, pending["name"], pending["ext"])
 
     # Last recognized songs (history, up to 5)
     if "history" in st.session_state and st.session_state["history"]:
@@ -305,9 +203,14 @@ def show_choose_page():
                     </div>
                     """, unsafe_allow_html=True)
             else:
+                from song_assets import get_song_assets
+                thumbnail = get_song_assets(item["song"], DB_FILE).get("thumbnail")
+                thumbnail_html = (
+                    f'<img src="data:image/png;base64,{base64.b64encode(thumbnail).decode()}" '
+                    f'style="float:right; height:2.2em; border-radius:6px;">' if thumbnail else "")
                 st.markdown(
                     f"""<div style="margin-bottom:0.85em; background:#232b3c; border-radius:14px; padding:0.9em 1.2em;">
-                        <b style="color:#35d2ea;">{display_name}</b>
+                        {thumbnail_html}<b style="color:#35d2ea;">{display_name}</b>
                         <div style="text-align:right; color:#b6dbfc; font-size:1.01em; margin-top:0.15em; margin-bottom:-0.3em;">
                             <span style='color:#aaa;'>at {timestamp}</span>
                         </div>
@@ -317,15 +220,41 @@ def show_choose_page():
 def show_record_page():
     st.markdown("#### Record a sample with your microphone")
     record_sec = st.slider("Seconds to record:", 3, 15, 6, key="slider_record_sec")
+    live_mode = st.checkbox("⚡ Live mode: stop as soon as the song is recognized", key="live_mode")
     cd_sr = 44100
     if not st.session_state.get("recording", False):
-        if st.button("Start Recording 🎙️", key="record_start_btn", use_container_width=True, type="primary"):
+        if live_mode:
+            if st.button("Start Listening 🎙️", key="record_live_btn", use_container_width=True, type="primary"):
+                import soundfile as sf
+                from live_recognition import recognize_live
+                progress = st.progress(0, text="🎤 Listening...")
+                def on_update(elapsed, result):
+                    best_guess = f" · {result['count']} matching fingerprints so far" if result["song"] else ""
+                    progress.progress(min(int(elapsed / record_sec * 100), 100),
+                                      text=f"🎤 Listening... {elapsed:.1f}s{best_guess}")
+                # Fingerprints and matches every incoming block, stops early once confident
+                result, audio, _ = recognize_live(DB_FILE, INDEX_ENGINE, INDEX_DIR, max_seconds=record_sec,
+                                                  sr=cd_sr, on_update=on_update)
+                temp_path = "query.wav"
+                sf.write(temp_path, audio, cd_sr)
+                st.session_state["query_path"] = temp_path
+                song_info = get_song(result["song"], DB_FILE) if result["song"] else {}
+                if result["song"]:
+                    prefetch_lyrics(*parse_artist_title(song_info.get("display_name", result["song"])))
+                st.session_state["recog_result"] = (result["song"], result["count"], song_info)
+                st.session_state["recog_path"] = temp_path
+                st.session_state["recog_stats"] = None
+                st.session_state["app_stage"] = "result"
+                st.rerun()
+        elif st.button("Start Recording 🎙️", key="record_start_btn", use_container_width=True, type="primary"):
             st.session_state["recording"] = True
             st.session_state["record_start"] = time.time()
             st.session_state["record_duration"] = record_sec
             st.session_state["audio_buffer"] = None
             st.rerun()
     elif st.session_state["recording"]:
+        import sounddevice as sd
+        import soundfile as sf
         duration = st.session_state["record_duration"]
         start = st.session_state["record_start"]
         now = time.time()
@@ -368,6 +297,7 @@ def show_upload_page():
         if temp_input_path.endswith(".wav"):
             os.rename(temp_input_path, temp_wav_path)
         else:
+            from build_database import convert_to_wav
             convert_to_wav(temp_input_path, temp_wav_path)
             os.remove(temp_input_path)
         st.session_state["query_path"] = temp_wav_path
@@ -382,17 +312,30 @@ def show_result_page():
     if query_path and os.path.exists(query_path):
         if ("recog_result" not in st.session_state or st.session_state.get("recog_path") != query_path):
             with st.spinner("🎶 Analyzing and recognizing the song..."):
-                best_song, match_count = recognize(query_path)
-                songs_info = load_songs()
-            st.session_state["recog_result"] = (best_song, match_count, songs_info)
+                from recognition import recognize
+                try:
+                    result = recognize(query_path, DB_FILE, engine=INDEX_ENGINE, index_dir=INDEX_DIR,
+                                       progressive=PROGRESSIVE, budget_ms=QUERY_BUDGET_MS)
+                except RuntimeError as e:
+                    # Database in an old format (see db_utils.check_schema_version)
+                    st.error(str(e))
+                    return
+                best_song, match_count = result["song"], result["count"]
+                # Metadata of just the matched song (indexed lookup, cached in-process)
+                song_info = get_song(best_song, DB_FILE) if best_song else {}
+                if best_song:
+                    # Start the lyrics search now, it is usually done before "Show Lyrics" is ticked
+                    prefetch_lyrics(*parse_artist_title(song_info.get("display_name", best_song)))
+            st.session_state["recog_result"] = (best_song, match_count, song_info)
             st.session_state["recog_path"] = query_path
+            st.session_state["recog_stats"] = {"timings": result["timings"], "counters": result["counters"]}
         else:
-            best_song, match_count, songs_info = st.session_state["recog_result"]
+            best_song, match_count, song_info = st.session_state["recog_result"]
         if best_song:
 
             # Save result to history if not a duplicate
             history = st.session_state.get("history", [])
-            info = songs_info.get(best_song, {})
+            info = song_info
             entry = {
                 "song": best_song,
                 "display_name": info.get("display_name", best_song),
@@ -467,6 +410,11 @@ def show_result_page():
             show_waveform = st.checkbox("Show Query Waveform & Peaks", key="show_waveform_peaks")
 
             if show_waveform:
+                import librosa
+                import librosa.display
+                import matplotlib.pyplot as plt
+                from fingerprinting import preprocess_audio, get_peaks
+                from song_assets import SR_QUERY, plot_spectrogram_peaks_connections_fast
                 y, sr = librosa.load(st.session_state["query_path"], sr=SR_QUERY, mono=True, duration=15)
                 y, sr = preprocess_audio(y, sr)
                 peaks = get_peaks(y, sr)
@@ -491,32 +439,15 @@ def show_result_page():
 
             st.markdown("---")
         
-            # Spectrogram visualizations
+            # Spectrogram visualizations (rendered when the song was added, see song_assets.py)
             st.subheader("🔊 Audio Fingerprint (Spectrogram)")
-            song_path = os.path.join(SONG_FOLDER, best_song)
-            y_full, sr_full = get_full_song_audio(song_path)
-            classic_img_key = f"classic_spectrogram_img_{best_song}"
-            if classic_img_key not in st.session_state:
-                progress = st.progress(0, text="Preparing full-song spectrogram...")
-                def prog_cb(val): progress.progress(val, text="Preparing full-song spectrogram...")
-                st.session_state[classic_img_key] = plot_debug_spectrogram_img_fast(
-                    y_full, sr_full, "Spectrogram of recognized song", progress_callback=prog_cb
-                )
-                progress.empty()
-            st.image(st.session_state[classic_img_key], use_container_width=True)
-            y_short, sr_short, peaks_short = get_peaks_plot_data(song_path)
-            peaks_img_key = f"peaks_spectrogram_img_{best_song}"
-            if peaks_img_key not in st.session_state:
-                st.session_state[peaks_img_key] = None
+            assets = get_result_assets(best_song)
+            st.image(assets["spectrogram"], use_container_width=True)
             show_peaks = st.checkbox("Show Peaks & Connections", key=f"showpeaksbtn_{best_song}")
             if show_peaks:
-                if st.session_state[peaks_img_key] is None:
-                    st.session_state[peaks_img_key] = plot_spectrogram_peaks_connections_fast(
-                        y_short, sr_short, peaks_short, fan_value=5, top_n=60,
-                        title="Spectrogram + Peaks + Connections"
-                    )
-                st.image(st.session_state[peaks_img_key], use_container_width=True)
+                st.image(assets["constellation"], use_container_width=True)
             st.markdown("---")
+            show_performance_panel(query_path)
             st.button("🔄 Start Over", key="reset_btn", use_container_width=True, on_click=lambda: st.session_state.update({"do_reset": True}))
         else:
             st.error("❌ No match found. Try a longer/clearer sample, or add more songs to your database.")
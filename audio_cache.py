@@ -0,0 +1,125 @@
+# audio_cache.py
+# Decoded songs, stored once as mono 16-bit PCM at the analysis sample rate in
+# memory-mappable .npy files named after the SHA-1 of the source file. Ingest,
+# rebuilds and the song pictures read these instead of decoding MP3/FLAC again,
+# and the song folder keeps the compressed originals instead of WAV copies.
+# A .json file next to every entry records the source file, so entries of
+# changed or deleted songs can be pruned (see prune_audio_cache).
+
+import hashlib
+import json
+import os
+import threading
+import librosa
+import numpy as np
+
+AUDIO_CACHE_DIR = "audio_cache"
+ANALYSIS_SR = 44100  # sample rate of the default analysis profile, so cached songs need no resampling
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+def file_digest(path, chunk_size=1 << 20):
+    # Digests are remembered by (path, size, mtime): an unchanged file is read only once per process
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    with _digests_lock:
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+PCM_SCALE = 32767.0
+
+def cache_path(digest, sr=ANALYSIS_SR, cache_dir=AUDIO_CACHE_DIR):
+    return os.path.join(cache_dir, f"{digest}_{sr}.npy")
+
+def _sidecar_path(npy):
+    return os.path.splitext(npy)[0] + ".json"
+
+def _source_info(path):
+    st = os.stat(path)
+    return {"source": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def load_audio(path, sr=ANALYSIS_SR, duration=None, cache_dir=AUDIO_CACHE_DIR):
+    """
+    Mono float32 samples of path at sr (first duration seconds if given).
+    The first call decodes the file into cache_dir, later calls memory-map the
+    cached samples and convert only the part that is returned. cache_dir=None
+    always decodes.
+    """
+    if cache_dir is None:
+        y, _ = librosa.load(path, sr=sr, mono=True, duration=duration)
+        return y, sr
+    npy = cache_path(file_digest(path), sr, cache_dir)
+    if not os.path.exists(npy):
+        os.makedirs(cache_dir, exist_ok=True)
+        y, _ = librosa.load(path, sr=sr, mono=True)
+        # Half the size of float32, the rounding stays 96 dB below full scale
+        pcm = np.round(np.clip(y, -1.0, 1.0) * PCM_SCALE).astype(np.int16)
+        # Several ingest workers may decode the same file, each writes its own tmp files
+        tmp = f"{npy}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_source_info(path), f)
+        os.replace(tmp, _sidecar_path(npy))
+        with open(tmp, "wb") as f:
+            np.save(f, pcm)
+        os.replace(tmp, npy)
+    try:
+        y = np.load(npy, mmap_mode="r")
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        y = np.load(npy)
+    if duration is not None:
+        y = y[:int(duration * sr)]
+    if y.dtype == np.int16:
+        return np.multiply(y, np.float32(1 / PCM_SCALE), dtype=np.float32), sr
+    # Entries from before the 16-bit format hold float32 already
+    return y, sr
+
+def prune_audio_cache(cache_dir=AUDIO_CACHE_DIR):
+    """
+    Delete cached songs whose source file was deleted or changed since it was
+    decoded, and entries without a source record. Returns (removed, kept).
+    """
+    removed = kept = 0
+    if not os.path.isdir(cache_dir):
+        return removed, kept
+    for name in os.listdir(cache_dir):
+        npy = os.path.join(cache_dir, name)
+        if name.endswith(".json") and not os.path.exists(os.path.splitext(npy)[0] + ".npy"):
+            os.remove(npy)  # left by a decode that did not finish
+        if not name.endswith(".npy"):
+            continue
+        try:
+            with open(_sidecar_path(npy), encoding="utf-8") as f:
+                info = json.load(f)
+            current = _source_info(info["source"])
+        except (OSError, ValueError, KeyError):
+            current = info = None
+        if current is not None and current == info:
+            kept += 1
+            continue
+        for stale in (npy, _sidecar_path(npy)):
+            if os.path.exists(stale):
+                os.remove(stale)
+        removed += 1
+    return removed, kept
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decoded-audio cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pruning = sub.add_parser("prune", help="Delete cached songs whose source file was changed or deleted")
+    pruning.add_argument("--dir", default=AUDIO_CACHE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        removed, kept = prune_audio_cache(args.dir)
+        print(f"Removed {removed} cached song(s), kept {kept}.")
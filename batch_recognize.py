@@ -0,0 +1,164 @@
+# batch_recognize.py
+# Tag many recordings offline: python batch_recognize.py recordings/ --out results.csv
+
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from build_database import AUDIO_EXTS
+from index_engine import open_index, ENGINES, INDEX_DIR
+from recognition import fingerprint_query, match_fingerprints, match_progressive, DB_FILE, INDEX_ENGINE
+
+FIELDS = ("file", "match", "count", "delta", "confidence", "fingerprints", "rounds", "fingerprint_ms", "match_ms",
+          "total_ms", "error")
+# Upper edges of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+def collect_inputs(inputs, list_file=None):
+    # Directories are searched recursively for audio files, files are taken as they are
+    paths = []
+    if list_file:
+        with open(list_file, encoding="utf-8") as f:
+            inputs = list(inputs) + [line.strip() for line in f if line.strip()]
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for filename in sorted(files):
+                    if os.path.splitext(filename)[1].lower() in AUDIO_EXTS:
+                        paths.append(os.path.join(root, filename))
+        else:
+            paths.append(item)
+    return paths
+
+def _fingerprint_job(path, params=None):
+    # Decoding + fingerprinting runs in the worker processes
+    t0 = time.perf_counter()
+    try:
+        hashes, offsets = fingerprint_query(path, params=params)
+        return path, hashes, offsets, time.perf_counter() - t0, None
+    except Exception as e:
+        return path, None, None, time.perf_counter() - t0, e
+
+class ResultWriter:
+    def __init__(self, out_path):
+        self.f = open(out_path, "w", newline="", encoding="utf-8")
+        self.jsonl = out_path.lower().endswith((".jsonl", ".json"))
+        if not self.jsonl:
+            self.csv = csv.DictWriter(self.f, fieldnames=FIELDS)
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.jsonl:
+            self.f.write(json.dumps(row) + "\n")
+        else:
+            self.csv.writerow(row)
+
+    def close(self):
+        self.f.close()
+
+def print_report(latencies_ms, elapsed, n_matched, n_errors):
+    n = len(latencies_ms)
+    print(f"\nProcessed {n} files in {elapsed:.1f}s: {n / elapsed:.2f} queries/sec "
+          f"({n_matched} matched, {n - n_matched - n_errors} no match, {n_errors} errors)")
+    if not n:
+        return
+    lat = np.asarray(latencies_ms)
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+    print(f"Latency per query: p50 {p50:.0f} ms | p95 {p95:.0f} ms | p99 {p99:.0f} ms | max {lat.max():.0f} ms")
+    edges = [0, *LATENCY_BUCKETS_MS, np.inf]
+    counts, _ = np.histogram(lat, bins=edges)
+    width = max(counts.max(), 1)
+    for lo, hi, count in zip(edges[:-1], edges[1:], counts):
+        label = f"{lo:>5.0f}-{hi:<5.0f} ms" if np.isfinite(hi) else f"{lo:>5.0f}+      ms"
+        print(f"  {label} {'#' * int(round(40 * count / width)):<40} {count}")
+
+def batch_recognize(paths, out_path, db_file=DB_FILE, engine=INDEX_ENGINE, index_dir=INDEX_DIR,
+                    workers=1, top_k=5, progressive=False, budget_ms=None):
+    """
+    Recognize every file in paths with one index kept open for the whole run.
+    Decoding and fingerprinting run in a process pool, lookups and scoring in
+    this process. One row per file is written to out_path (.csv or .jsonl).
+    With progressive, budget_ms caps the lookup and scoring time of every file.
+    """
+    index = open_index(engine, db_file, index_dir)
+    _, params = index.analysis_profile()
+    writer = ResultWriter(out_path)
+    latencies_ms = []
+    n_matched = n_errors = 0
+    t_start = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if pool is not None:
+            results = (f.result() for f in as_completed([pool.submit(_fingerprint_job, p, params) for p in paths]))
+        else:
+            results = (_fingerprint_job(p, params) for p in paths)
+        for idx, (path, hashes, offsets, fp_seconds, error) in enumerate(results, 1):
+            row = dict.fromkeys(FIELDS, "")
+            row["file"] = path
+            row["fingerprint_ms"] = round(fp_seconds * 1000, 1)
+            if error is None:
+                t0 = time.perf_counter()
+                counters = {}
+                try:
+                    if progressive:
+                        deadline = t0 + budget_ms / 1000 if budget_ms else None
+                        result = match_progressive(index, hashes, offsets, top_k, counters=counters, deadline=deadline)
+                    else:
+                        result = match_fingerprints(index, hashes, offsets, top_k)
+                except Exception as e:
+                    error = e
+                match_seconds = time.perf_counter() - t0
+                row["match_ms"] = round(match_seconds * 1000, 1)
+                row["fingerprints"] = len(hashes)
+                row["rounds"] = counters.get("rounds", "")
+            else:
+                match_seconds = 0.0
+            if error is not None:
+                n_errors += 1
+                # The type name, also for exceptions without a message
+                row["error"] = type(error).__name__ + (f": {error}" if str(error) else "")
+                print(f"({idx}/{len(paths)}) ❌ {path}: {row['error']}")
+            else:
+                row.update(match=result["song"] or "", count=result["count"] or 0, delta=result["delta"] or 0,
+                           confidence=round(result["confidence"], 4) if result["confidence"] is not None else "")
+                n_matched += bool(result["song"])
+                print(f"({idx}/{len(paths)}) {path} -> {result['song'] or 'no match'}")
+            total_ms = (fp_seconds + match_seconds) * 1000
+            row["total_ms"] = round(total_ms, 1)
+            latencies_ms.append(total_ms)
+            writer.write(row)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        writer.close()
+        index.close()
+    print_report(latencies_ms, time.perf_counter() - t_start, n_matched, n_errors)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recognize a directory or list of recordings offline")
+    parser.add_argument("inputs", nargs="*", help="Audio files and/or directories")
+    parser.add_argument("--list", help="Text file with one audio path per line")
+    parser.add_argument("--out", default="batch_results.csv", help="Output file (.csv or .jsonl)")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--engine", choices=ENGINES, default=INDEX_ENGINE)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of decoding/fingerprinting processes (default: all cores)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--progressive", action="store_true",
+                        help="Look hashes up in rounds, rarest first, and stop once the match is clear")
+    parser.add_argument("--budget-ms", type=float, help="Lookup time budget per file in progressive mode")
+    args = parser.parse_args()
+
+    paths = collect_inputs(args.inputs, args.list)
+    if not paths:
+        print("No audio files given!")
+    else:
+        batch_recognize(paths, args.out, args.db, args.engine, args.index_dir, args.workers, args.top_k,
+                        args.progressive, args.budget_ms)
@@ -0,0 +1,388 @@
+# benchmark.py
+# Reproducible offline benchmarks: python benchmark.py --out bench.json [--compare old.json]
+
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from build_database import build_database
+from db_utils import add_song_to_db, add_fingerprints_bulk
+from fingerprinting import ANALYSIS_PROFILES, DT_BITS, preprocess_audio, get_peaks, generate_fingerprints
+from index_engine import ENGINES
+from recognition import recognize
+
+BENCH_SR = 22050
+DT_MASK = (1 << DT_BITS) - 1
+
+# === Synthetic catalogue ===
+def synth_song(seed, seconds, sr=BENCH_SR):
+    """
+    Deterministic synthetic "song": random notes with harmonics, chirps and
+    short noise bursts over a quiet noise floor.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    y = 0.01 * rng.standard_normal(n)
+    t_note = np.arange(int(0.6 * sr)) / sr
+    for _ in range(int(seconds * 4)):
+        start = rng.integers(0, max(1, n - len(t_note)))
+        length = rng.integers(len(t_note) // 4, len(t_note))
+        f0 = 110 * 2 ** (rng.integers(0, 48) / 12)
+        tt = t_note[:length]
+        note = sum(np.sin(2 * np.pi * f0 * h * tt) / h for h in (1, 2, 3))
+        y[start:start + length] += note * np.exp(-3 * tt)
+    for _ in range(int(seconds / 2)):
+        start = rng.integers(0, max(1, n - sr))
+        tt = np.arange(sr // 2) / sr
+        f_start, f_end = rng.uniform(200, 3000, size=2)
+        y[start:start + len(tt)] += 0.5 * np.sin(2 * np.pi * (f_start * tt + (f_end - f_start) * tt ** 2))
+    for _ in range(int(seconds)):
+        start = rng.integers(0, max(1, n - sr // 10))
+        y[start:start + sr // 10] += 0.3 * rng.standard_normal(sr // 10)
+    return (0.8 * y / np.max(np.abs(y))).astype(np.float32)
+
+def add_noise(y, snr_db, rng):
+    noise = rng.standard_normal(len(y))
+    signal_power = np.mean(y ** 2)
+    noise *= np.sqrt(signal_power / (10 ** (snr_db / 10)) / np.mean(noise ** 2))
+    return (y + noise).astype(np.float32)
+
+def apply_gain(y, gain_db):
+    # Louder clips are hard-clipped like a real overdriven recording
+    return np.clip(y * 10 ** (gain_db / 20), -1, 1).astype(np.float32)
+
+def write_catalogue(folder, n_songs, seconds, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(n_songs):
+        sf.write(os.path.join(folder, f"song_{i:05d}.wav"), synth_song(seed + i, seconds), BENCH_SR)
+
+def pad_catalogue(db_file, n_total, seed=0):
+    """
+    Grow the index to n_total songs with filler songs. Each filler takes the
+    hashes of a real song, with the time gaps (dt bits) shuffled between them
+    and shuffled offsets: common frequency pairs make common hashes as in a
+    real catalogue of that size, but a filler does not copy whole posting
+    lists, and it never aligns with a query.
+    """
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_file)
+    n_now = conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+    real = [row[0] for row in conn.execute("SELECT id FROM songs WHERE filename NOT LIKE 'filler!_%' ESCAPE '!'")]
+    # fingerprints has no song_id index: read the postings of the real songs in one scan
+    rows = np.array(conn.execute(
+        f"SELECT song_id, hash, offset FROM fingerprints WHERE song_id IN ({','.join('?' * len(real))})",
+        real).fetchall(), dtype=np.int64).reshape(-1, 3)
+    rows = rows[np.argsort(rows[:, 0], kind="stable")]
+    # One source per real song that has postings
+    _, starts = np.unique(rows[:, 0], return_index=True)
+    sources = np.split(rows[:, 1:], starts[1:]) if len(rows) else []
+    if not sources:
+        conn.close()
+        raise ValueError(f"No fingerprints of real songs in '{db_file}' to pad the catalogue with")
+    for i in range(n_now, n_total):
+        source = sources[rng.integers(0, len(sources))]
+        song_id = add_song_to_db(conn, f"filler_{i:05d}.wav", commit=False)
+        hashes = (source[:, 0] & ~DT_MASK) | rng.permutation(source[:, 0] & DT_MASK)
+        add_fingerprints_bulk(conn, song_id, hashes, rng.permutation(source[:, 1]), commit=False)
+    conn.commit()
+    conn.close()
+
+# === Measurements ===
+def percentiles(values_ms):
+    values = np.asarray(values_ms)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"n": len(values), "mean_ms": float(values.mean()), "p50_ms": float(p50),
+            "p90_ms": float(p90), "p99_ms": float(p99), "max_ms": float(values.max())}
+
+def bench_stages(lengths, repeats, seed):
+    # Warm-up: the first resample/STFT call pays for imports and JIT compilation
+    y_pre, sr = preprocess_audio(synth_song(seed, 2), BENCH_SR)
+    generate_fingerprints(get_peaks(y_pre, sr))
+    results = []
+    for seconds in lengths:
+        timings = {"preprocess_audio": [], "get_peaks": [], "generate_fingerprints": []}
+        for r in range(repeats):
+            y = synth_song(seed + 10_000 + r, seconds)
+            t0 = time.perf_counter()
+            y_pre, sr = preprocess_audio(y, BENCH_SR)
+            t1 = time.perf_counter()
+            peaks = get_peaks(y_pre, sr)
+            t2 = time.perf_counter()
+            hashes, _ = generate_fingerprints(peaks)
+            t3 = time.perf_counter()
+            timings["preprocess_audio"].append((t1 - t0) * 1000)
+            timings["get_peaks"].append((t2 - t1) * 1000)
+            timings["generate_fingerprints"].append((t3 - t2) * 1000)
+        row = {"seconds": seconds, "peaks": int(len(peaks)), "fingerprints": int(len(hashes))}
+        row.update({stage: float(np.median(ms)) for stage, ms in timings.items()})
+        results.append(row)
+        print(f"  {seconds:>5.0f}s clip: " + " | ".join(f"{k} {row[k]:.1f} ms" for k in timings))
+    return results
+
+def bench_ingest(workdir, n_songs, seconds, workers, seed):
+    folder = os.path.join(workdir, "songs")
+    db_file = os.path.join(workdir, "bench.db")
+    write_catalogue(folder, n_songs, seconds, seed)
+    t0 = time.perf_counter()
+    # Fingerprinting throughput only: no pictures, and every run decodes from scratch
+    build_database(folder, db_file, workers=workers, assets=False, cache_dir=None)
+    elapsed = time.perf_counter() - t0
+    conn = sqlite3.connect(db_file)
+    n_fps = conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+    conn.close()
+    result = {"songs": n_songs, "song_seconds": seconds, "workers": workers, "seconds": elapsed,
+              "songs_per_sec": n_songs / elapsed, "fingerprints": n_fps, "fingerprints_per_sec": n_fps / elapsed}
+    print(f"  Ingest: {result['songs_per_sec']:.2f} songs/sec, {result['fingerprints_per_sec']:,.0f} fingerprints/sec")
+    return folder, db_file, result
+
+def make_queries(folder, workdir, n_queries, clip_seconds, seed):
+    """Cut clean clips plus noisy and gain-changed variants from random catalogue songs."""
+    rng = np.random.default_rng(seed)
+    songs = sorted(f for f in os.listdir(folder) if f.endswith(".wav"))
+    conditions = {"clean": lambda y: y}
+    for snr in (20, 10, 5):
+        conditions[f"snr_{snr}db"] = lambda y, snr=snr: add_noise(y, snr, rng)
+    for gain in (-20, 6):
+        conditions[f"gain_{gain:+d}db"] = lambda y, gain=gain: apply_gain(y, gain)
+    qdir = os.path.join(workdir, "queries")
+    os.makedirs(qdir, exist_ok=True)
+    queries = []
+    for i in range(n_queries):
+        song = songs[rng.integers(0, len(songs))]
+        y, sr = sf.read(os.path.join(folder, song), dtype="float32")
+        start = rng.integers(0, max(1, len(y) - int(clip_seconds * sr)))
+        clip = y[start:start + int(clip_seconds * sr)]
+        for name, transform in conditions.items():
+            path = os.path.join(qdir, f"q{i:04d}_{name}.wav")
+            sf.write(path, transform(clip), sr)
+            queries.append({"path": path, "expected": song, "condition": name})
+    return queries
+
+def bench_queries(db_file, queries, engine, catalogue_size, label=None, progressive=False, budget_ms=None):
+    latencies = []
+    stage_ms = {}
+    db_rows = []
+    rounds = []
+    bins = []
+    by_condition = {}
+    for q in queries:
+        t0 = time.perf_counter()
+        result = recognize(q["path"], db_file, show_benchmark=False, engine=engine, use_cache=False,
+                           progressive=progressive, budget_ms=budget_ms)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        for name, ms in result["timings"].items():
+            stage_ms.setdefault(name, []).append(ms)
+        db_rows.append(result["counters"].get("db_rows", 0))
+        rounds.append(result["counters"].get("rounds", 1))
+        bins.append(result["counters"].get("candidate_bins", 0))
+        stats = by_condition.setdefault(q["condition"], [0, 0])
+        stats[0] += result["song"] == q["expected"]
+        stats[1] += 1
+    accuracy = {name: hits / total for name, (hits, total) in by_condition.items()}
+    row = {"catalogue_size": catalogue_size, "engine": engine, "latency": percentiles(latencies),
+           "stage_mean_ms": {name: float(np.mean(ms)) for name, ms in stage_ms.items()},
+           "db_rows_mean": float(np.mean(db_rows)), "rounds_mean": float(np.mean(rounds)),
+           "candidate_bins_mean": float(np.mean(bins)), "top1_accuracy": accuracy}
+    print(f"  {catalogue_size:>6} songs ({label or engine}): p50 {row['latency']['p50_ms']:.0f} ms, "
+          f"p99 {row['latency']['p99_ms']:.0f} ms | {row['db_rows_mean']:,.0f} rows/query | accuracy "
+          + ", ".join(f"{k} {v:.0%}" for k, v in accuracy.items()))
+    return row
+
+def bench_profiles(workdir, folder, queries, profiles, workers):
+    """Index the audio catalogue once per analysis profile: ingest speed vs. query latency and accuracy."""
+    n_songs = len([f for f in os.listdir(folder) if f.endswith(".wav")])
+    rows = []
+    for name in profiles:
+        db_file = os.path.join(workdir, f"bench_{name}.db")
+        t0 = time.perf_counter()
+        build_database(folder, db_file, workers=workers, assets=False, cache_dir=None, profile=name)
+        elapsed = time.perf_counter() - t0
+        row = bench_queries(db_file, queries, "sqlite", n_songs, label=f"profile {name}")
+        row.update(profile=name, ingest_songs_per_sec=n_songs / elapsed)
+        rows.append(row)
+    return rows
+
+# === App startup ===
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+HEAVY_MODULES = ("librosa", "matplotlib", "scipy", "sounddevice", "pydub", "lyricsgenius")
+
+# Runs in a fresh interpreter per measurement, so nothing is imported yet.
+# "import": streamlit plus the module-level imports of app.py.
+# "render": the first run of the whole script, as a new container sees it.
+_STARTUP_CHILD = """
+import ast, json, sys, time
+mode, app_file, heavy = sys.argv[1], sys.argv[2], sys.argv[3].split(",")
+sys.path.insert(0, __import__("os").path.dirname(app_file))
+if mode == "import":
+    with open(app_file, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    imports = ast.Module([n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))], [])
+    t0 = time.perf_counter()
+    exec(compile(imports, app_file, "exec"), {})
+else:
+    from streamlit.testing.v1 import AppTest
+    t0 = time.perf_counter()
+    at = AppTest.from_file(app_file, default_timeout=120).run()
+    if at.exception:
+        raise SystemExit(str(at.exception))
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"ms": ms, "loaded": [m for m in heavy if m in sys.modules]}))
+"""
+
+def _startup_run(mode, workdir):
+    # The app creates its song folder and database in the working directory
+    out = subprocess.run([sys.executable, "-c", _STARTUP_CHILD, mode, APP_FILE, ",".join(HEAVY_MODULES)],
+                         capture_output=True, text=True, cwd=workdir, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def bench_startup(workdir, repeats):
+    """Cold start of the app: import time and time to the first rendered page, medians of fresh processes."""
+    app_dir = os.path.join(workdir, "app")
+    os.makedirs(app_dir, exist_ok=True)
+    imports = [_startup_run("import", app_dir) for _ in range(repeats)]
+    renders = [_startup_run("render", app_dir) for _ in range(repeats)]
+    result = {"import_ms": float(np.median([r["ms"] for r in imports])),
+              "first_render_ms": float(np.median([r["ms"] for r in renders])),
+              "heavy_modules_at_startup": sorted(set(imports[0]["loaded"]) | set(renders[0]["loaded"]))}
+    print(f"  Imports {result['import_ms']:.0f} ms | first render {result['first_render_ms']:.0f} ms | "
+          f"heavy modules loaded: {', '.join(result['heavy_modules_at_startup']) or 'none'}")
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(old_path, new):
+    # Print the relative change of the headline numbers against an earlier run
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    print(f"\nCompared with {old_path} (rev {old['meta'].get('revision')}):")
+    def line(name, before, after, higher_is_better, tolerance=5.0):
+        change = (after - before) / before * 100 if before else 0.0
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        print(f"  {name:<40} {before:>10.2f} -> {after:>10.2f} ({change:+.1f}%{' ⚠️' if regressed else ''})")
+    if "startup" in old and "startup" in new:
+        line("startup imports (ms)", old["startup"]["import_ms"], new["startup"]["import_ms"], False)
+        line("startup first render (ms)", old["startup"]["first_render_ms"], new["startup"]["first_render_ms"], False)
+    if "ingest" in old and "ingest" in new:
+        line("ingest songs/sec", old["ingest"]["songs_per_sec"], new["ingest"]["songs_per_sec"], True)
+    for a, b in zip(old.get("stages", []), new.get("stages", [])):
+        for stage in ("preprocess_audio", "get_peaks", "generate_fingerprints"):
+            line(f"{stage} {b['seconds']:.0f}s (ms)", a[stage], b[stage], False)
+    for a, b in zip(old.get("queries", []), new.get("queries", [])):
+        line(f"query p50 @{b['catalogue_size']} (ms)", a["latency"]["p50_ms"], b["latency"]["p50_ms"], False)
+        line(f"query p99 @{b['catalogue_size']} (ms)", a["latency"]["p99_ms"], b["latency"]["p99_ms"], False)
+        if "db_rows_mean" in a:
+            line(f"rows per query @{b['catalogue_size']}", a["db_rows_mean"], b["db_rows_mean"], False)
+        for cond, acc in b["top1_accuracy"].items():
+            if cond in a["top1_accuracy"]:
+                line(f"accuracy {cond} @{b['catalogue_size']}", a["top1_accuracy"][cond], acc, True)
+    if "progressive" in old and "progressive" in new:
+        a, b = old["progressive"], new["progressive"]
+        line("progressive p99 (ms)", a["latency"]["p99_ms"], b["latency"]["p99_ms"], False)
+        line("progressive rows per query", a["db_rows_mean"], b["db_rows_mean"], False)
+        for cond, acc in b["top1_accuracy"].items():
+            if cond in a["top1_accuracy"]:
+                line(f"progressive accuracy {cond}", a["top1_accuracy"][cond], acc, True)
+    old_profiles = {row["profile"]: row for row in old.get("profiles", [])}
+    for b in new.get("profiles", []):
+        a = old_profiles.get(b["profile"])
+        if a:
+            line(f"profile {b['profile']} ingest songs/sec", a["ingest_songs_per_sec"], b["ingest_songs_per_sec"], True)
+            line(f"profile {b['profile']} query p50 (ms)", a["latency"]["p50_ms"], b["latency"]["p50_ms"], False)
+
+def run(args):
+    random.seed(args.seed)
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    lengths = [float(s) for s in args.stage_lengths.split(",")]
+    results = {"meta": {"revision": git_revision(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "python": platform.python_version(), "machine": platform.machine(),
+                        "cpus": os.cpu_count(), "args": vars(args)}}
+    with tempfile.TemporaryDirectory(prefix="shazam_bench_") as workdir:
+        print("App startup:")
+        results["startup"] = bench_startup(workdir, args.repeats)
+    if not args.startup:
+        results.update(run_pipeline(args, sizes, lengths))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.out}")
+    if args.compare:
+        compare(args.compare, results)
+
+def run_pipeline(args, sizes, lengths):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="shazam_bench_") as workdir:
+        print("Per-stage cost:")
+        results["stages"] = bench_stages(lengths, args.repeats, args.seed)
+
+        n_audio = min(args.audio_songs, sizes[0])
+        print(f"Ingest ({n_audio} songs of {args.song_seconds:.0f}s):")
+        folder, db_file, results["ingest"] = bench_ingest(workdir, n_audio, args.song_seconds,
+                                                          args.workers, args.seed)
+
+        queries = make_queries(folder, workdir, args.queries, args.clip_seconds, args.seed)
+        print(f"Queries ({len(queries)} clips of {args.clip_seconds:.0f}s):")
+        results["queries"] = []
+        for size in sizes:
+            pad_catalogue(db_file, size, args.seed)
+            for engine in args.engines.split(","):
+                if engine == "mmap":
+                    from index_engine import export_index
+                    export_index(db_file, os.path.join(workdir, "fingerprint_index"))
+                    cwd = os.getcwd()
+                    os.chdir(workdir)  # recognize() uses the default index dir
+                    try:
+                        results["queries"].append(bench_queries(db_file, queries, engine, size))
+                    finally:
+                        os.chdir(cwd)
+                else:
+                    results["queries"].append(bench_queries(db_file, queries, engine, size))
+
+        # Progressive lookups on the largest catalogue, against the full lookup above
+        print(f"Progressive lookups ({sizes[-1]} songs, budget {args.budget_ms or 'none'} ms):")
+        results["progressive"] = bench_queries(db_file, queries, "sqlite", sizes[-1], "sqlite progressive",
+                                               progressive=True, budget_ms=args.budget_ms)
+
+        profiles = [p for p in args.profiles.split(",") if p]
+        if profiles:
+            print(f"Analysis profiles ({n_audio} songs, sqlite):")
+            results["profiles"] = bench_profiles(workdir, folder, queries, profiles, args.workers)
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ingest, lookup and accuracy benchmarks on a synthetic catalogue")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Catalogue sizes for the query benchmark")
+    parser.add_argument("--audio-songs", type=int, default=100,
+                        help="Songs synthesized as real audio, the rest of each size is filler")
+    parser.add_argument("--song-seconds", type=float, default=30)
+    parser.add_argument("--stage-lengths", default="10,60,300", help="Clip lengths (s) for the per-stage benchmark")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=20, help="Clips per noise/gain condition")
+    parser.add_argument("--clip-seconds", type=float, default=8)
+    parser.add_argument("--engines", default="sqlite", help=f"Comma separated, from {ENGINES}")
+    parser.add_argument("--profiles", default=",".join(ANALYSIS_PROFILES),
+                        help="Comma separated analysis profiles to compare (empty to skip)")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Latency budget per query for the progressive lookup benchmark")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup", action="store_true",
+                        help="Only measure app startup (import time and first render)")
+    run(parser.parse_args())
@@ -1,13 +1,28 @@
 import os
 import sqlite3
-import librosa
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from pydub import AudioSegment
-from fingerprinting import preprocess_audio, get_peaks, generate_fingerprints
-from db_utils import create_tables_and_indices, song_in_db, add_song_to_db, add_fingerprints_bulk
+from fingerprinting import (ANALYSIS_PROFILES, fingerprint_samples, get_profile,
+                            audio_duration, fingerprint_file_streaming, STREAMING_MIN_SECONDS)
+from db_utils import (create_tables_and_indices, song_in_db, song_by_audio_hash, add_song_to_db, add_fingerprints_bulk,
+                      save_song_assets, ensure_analysis_profile)
+from index_engine import lookup_postings
+from matching import score_matches
+from result_cache import audio_digest
+from song_assets import try_render_song_assets
+from songs_db import add_song
+from audio_cache import load_audio, prune_audio_cache, AUDIO_CACHE_DIR
 
 AUDIO_EXTS = (".mp3", ".m4a", ".flac", ".ogg", ".aac", ".wma", ".opus", ".alac", ".wav")
 SONG_FOLDER = "music_wavs"
 DB_FILE = "music_fingerprints.db"
+NEAR_DUPLICATE_SAMPLE = 2000  # fingerprints of a new song checked against the index
+# Share of them aligned with one indexed song that makes it a near-duplicate. MP3/OGG
+# re-encodes keep 5-10 % (a resampled copy ~25 %), unrelated songs stay below 0.2 %.
+NEAR_DUPLICATE_RATIO = 0.03
+NEAR_DUPLICATE_MIN_COUNT = 10  # aligned fingerprints, keeps very short songs from matching by chance
 
 def convert_to_wav(src, dst, sr=44100):
     try:
@@ -21,50 +36,218 @@ def convert_to_wav(src, dst, sr=44100):
         print(f"  ❌ Conversion failed for {src}: {e}")
         return False
 
-def build_database(song_folder=SONG_FOLDER, db_file=DB_FILE):
+def fingerprint_file(path, cache_dir=AUDIO_CACHE_DIR, params=None):
+    # Decode + preprocess + peaks + hashes for one file (runs inside the worker processes)
+    # params: analysis profile of the database (db_utils.ensure_analysis_profile)
+    # Returns (n_peaks, hashes, offsets, audio_hash)
+    params = params or get_profile()
+    # Long recordings (DJ mixes, lectures) are decoded block by block to keep memory flat,
+    # their content hash is taken over the file bytes instead of the samples
+    duration = audio_duration(path)
+    if duration and duration > STREAMING_MIN_SECONDS:
+        return (*fingerprint_file_streaming(path, params=params), audio_digest(path=path))
+    # Decoded once into the audio cache (at the profile's rate), memory-mapped on every later rebuild
+    y, sr = load_audio(path, sr=params["sr"], cache_dir=cache_dir)
+    return (*fingerprint_samples(y, sr, params), audio_digest((y, sr)))
+
+def _fingerprint_job(path, with_assets=False, cache_dir=AUDIO_CACHE_DIR, params=None):
+    # Never raise inside a worker, report the error back to the writer instead
+    try:
+        params = params or get_profile()
+        n_peaks, hashes, offsets, audio_hash = fingerprint_file(path, cache_dir, params)
+        assets = try_render_song_assets(path, cache_dir, params["sr"]) if with_assets and len(hashes) else None
+        return path, n_peaks, hashes, offsets, audio_hash, assets, None
+    except Exception as e:
+        return path, 0, None, None, None, None, e
+
+# === Duplicate detection ===
+# An exact duplicate decodes to the same samples as an indexed song (songs.audio_hash).
+# A near-duplicate (another encoding or bitrate of it) is found like a query: a
+# sample of the new fingerprints is looked up and scored against the index.
+# Either one would only double the postings every matching query has to read.
+class DuplicateSongError(Exception):
+    def __init__(self, filename, duplicate_of, overlap=None):
+        self.filename = filename
+        self.duplicate_of = duplicate_of
+        self.overlap = overlap  # None for an exact duplicate
+        kind = "an exact copy" if overlap is None else f"a near-duplicate ({overlap:.0%} overlap)"
+        super().__init__(f"{filename} is {kind} of {duplicate_of}")
+
+def find_near_duplicate(conn, hashes, offsets, sample=NEAR_DUPLICATE_SAMPLE, min_ratio=NEAR_DUPLICATE_RATIO):
+    """(filename, overlap) of the indexed song sharing the most time-aligned fingerprints, or None below min_ratio."""
+    if len(hashes) == 0:
+        return None
+    # Evenly spread over the song, so an edit at the start or end does not hide a copy
+    idx = np.unique(np.linspace(0, len(hashes) - 1, min(sample, len(hashes))).astype(np.int64))
+    q_hashes = np.asarray(hashes, dtype=np.int64)[idx]
+    q_offsets = np.asarray(offsets, dtype=np.int64)[idx]
+    best = score_matches(q_hashes, q_offsets, *lookup_postings(conn, q_hashes), top_k=1)
+    if not best:
+        return None
+    song_id, _, count = best[0]
+    overlap = min(count / len(idx), 1.0)
+    if overlap < min_ratio or count < NEAR_DUPLICATE_MIN_COUNT:
+        return None
+    row = conn.execute("SELECT filename FROM songs WHERE id=?", (song_id,)).fetchone()
+    return (row[0], overlap) if row else None
+
+def find_duplicate(conn, audio_hash, hashes, offsets, near_duplicates=True):
+    # (filename, overlap) of an indexed copy of the song, overlap None for an exact one
+    row = song_by_audio_hash(conn, audio_hash) if audio_hash else None
+    if row:
+        return row[1], None
+    return find_near_duplicate(conn, hashes, offsets) if near_duplicates else None
+
+def ingest_file(path, display_name=None, spotify_url="", db_file=DB_FILE, skip_near_duplicates=True):
+    """
+    Fingerprint and index exactly one audio file in a single transaction.
+    Unlike build_database() this never rescans the song folder, so the cost
+    does not depend on the size of the catalogue. Returns the song id, or None.
+    Raises DuplicateSongError if the audio is already indexed under another name.
+    """
+    filename = os.path.basename(path)
     conn = sqlite3.connect(db_file)
-    create_tables_and_indices(conn)
+    try:
+        create_tables_and_indices(conn)
+        song_id = song_in_db(conn, filename)
+        if song_id:
+            print(f"Already fingerprinted: {filename}")
+        else:
+            _, params = ensure_analysis_profile(conn)
+            n_peaks, hashes, offsets, audio_hash = fingerprint_file(path, params=params)
+            print(f"Fingerprinting: {filename} | Peaks: {n_peaks} | Fingerprints: {len(hashes)}")
+            if len(hashes) == 0:
+                print("    ⚠️ No fingerprints extracted, skipping.")
+                return None
+            duplicate = find_duplicate(conn, audio_hash, hashes, offsets, skip_near_duplicates)
+            if duplicate:
+                raise DuplicateSongError(filename, *duplicate)
+            assets = try_render_song_assets(path, sr=params["sr"])
+            # The song row, all its fingerprints and its pictures are committed together
+            with conn:
+                song_id = add_song_to_db(conn, filename, commit=False, display_name=display_name or None,
+                                         spotify_url=spotify_url, duration=audio_duration(path),
+                                         audio_hash=audio_hash)
+                add_fingerprints_bulk(conn, song_id, hashes, offsets, commit=False)
+                if assets:
+                    save_song_assets(conn, song_id, assets, commit=False)
+            return song_id
+    finally:
+        conn.close()
+    # Already indexed: only fill in a display name it does not have yet
+    if display_name:
+        add_song(filename, display_name, spotify_url, db_file=db_file)
+    return song_id
 
-    # --- Convert to WAV if needed ---
-    for filename in os.listdir(song_folder):
-        ext = os.path.splitext(filename)[1].lower()
-        if ext in AUDIO_EXTS and ext != ".wav":
-            src = os.path.join(song_folder, filename)
-            dst = os.path.join(song_folder, os.path.splitext(filename)[0] + ".wav")
-            if not os.path.exists(dst):
-                convert_to_wav(src, dst)
+def build_database(song_folder=SONG_FOLDER, db_file=DB_FILE, workers=1, txn_fingerprints=500000, assets=True,
+                   cache_dir=AUDIO_CACHE_DIR, profile=None, skip_near_duplicates=True):
+    # profile: analysis profile for a new database (an existing one keeps its own)
+    # Exact duplicates of indexed songs are always skipped, near-duplicates unless skip_near_duplicates is False
+    conn = sqlite3.connect(db_file)
+    create_tables_and_indices(conn)
+    try:
+        profile, params = ensure_analysis_profile(conn, profile)
+    except RuntimeError:
+        conn.close()
+        raise
+    print(f"Analysis profile: {profile} ({params['sr']} Hz, n_fft {params['n_fft']}, hop {params['hop_length']})")
 
-    # --- Fingerprint all new WAVs ---
-    files = [f for f in os.listdir(song_folder) if f.lower().endswith(".wav")]
+    # --- Find the songs that are not fingerprinted yet ---
+    # Songs are read in their own format (decoded once into the audio cache).
+    # Older versions converted everything to WAV: when such a copy exists, the
+    # original is skipped so the song is not indexed twice.
+    files = [f for f in os.listdir(song_folder) if os.path.splitext(f)[1].lower() in AUDIO_EXTS]
+    wav_stems = {os.path.splitext(f)[0] for f in files if f.lower().endswith(".wav")}
     total = len(files)
+    todo = []
     for idx, filename in enumerate(files, 1):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() != ".wav" and stem in wav_stems:
+            continue
         if song_in_db(conn, filename):
             print(f"({idx}/{total}) Already fingerprinted: {filename}")
-            continue
-        print(f"({idx}/{total}) Fingerprinting: {filename}")
-        path = os.path.join(song_folder, filename)
-        try:
-            y, sr = librosa.load(path, sr=None, mono=True)
-            y, sr = preprocess_audio(y, sr)
-            peaks = get_peaks(y, sr)
-            fingerprints = generate_fingerprints(peaks)
-            print(f"    Peaks: {len(peaks)} | Fingerprints: {len(fingerprints)}")
-            if not fingerprints:
+        else:
+            todo.append(os.path.join(song_folder, filename))
+
+    # --- Fingerprint them (in a process pool if workers > 1) ---
+    # This process is the only writer: it collects results and inserts them
+    # in large transactions, committing every txn_fingerprints rows.
+    t_start = time.perf_counter()
+    n_songs = n_fps = pending = n_duplicates = 0
+    if workers > 1 and len(todo) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = (f.result() for f in as_completed(
+            [pool.submit(_fingerprint_job, p, assets, cache_dir, params) for p in todo]))
+    else:
+        pool = None
+        results = (_fingerprint_job(p, assets, cache_dir, params) for p in todo)
+    try:
+        for idx, (path, n_peaks, hashes, offsets, audio_hash, song_assets, error) in enumerate(results, 1):
+            filename = os.path.basename(path)
+            print(f"({idx}/{len(todo)}) Fingerprinting: {filename}")
+            if error is not None:
+                print(f"    ❌ Error processing {filename}: {error}")
+                continue
+            print(f"    Peaks: {n_peaks} | Fingerprints: {len(hashes)}")
+            if len(hashes) == 0:
                 print("    ⚠️ No fingerprints extracted, skipping.")
                 continue
-            song_id = add_song_to_db(conn, filename)
-            add_fingerprints_bulk(conn, song_id, fingerprints)
+            try:
+                # Also sees the songs of this run that are not committed yet
+                duplicate = find_duplicate(conn, audio_hash, hashes, offsets, skip_near_duplicates)
+                if duplicate:
+                    print(f"    ⏭️ Skipped: {DuplicateSongError(filename, *duplicate)}")
+                    n_duplicates += 1
+                    continue
+                song_id = add_song_to_db(conn, filename, commit=False, duration=audio_duration(path),
+                                         audio_hash=audio_hash)
+                add_fingerprints_bulk(conn, song_id, hashes, offsets, commit=False)
+                if song_assets:
+                    save_song_assets(conn, song_id, song_assets, commit=False)
+            except Exception as e:
+                print(f"    ❌ Error processing {filename}: {e}")
+                continue
+            n_songs += 1
+            n_fps += len(hashes)
+            pending += len(hashes)
+            if pending >= txn_fingerprints:
+                conn.commit()
+                pending = 0
             print(f"    ✅ Done: {filename}")
-        except Exception as e:
-            print(f"    ❌ Error processing {filename}: {e}")
+        conn.commit()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        conn.close()
 
-    conn.close()
+    elapsed = time.perf_counter() - t_start
     print(f"\nAll songs processed and indexed! Database: {db_file}")
+    if n_songs:
+        print(f"Indexed {n_songs} songs / {n_fps} fingerprints in {elapsed:.1f}s "
+              f"({n_songs / elapsed:.2f} songs/sec, {n_fps / elapsed:,.0f} fingerprints/sec, {workers} worker(s))")
+    if n_duplicates:
+        print(f"Skipped {n_duplicates} duplicate(s) of songs already in the database.")
+    if cache_dir is not None:
+        # Decoded copies of songs that were replaced or deleted since
+        removed, _ = prune_audio_cache(cache_dir)
+        if removed:
+            print(f"Removed {removed} outdated song(s) from the audio cache '{cache_dir}'.")
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fingerprint all songs in the song folder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of fingerprinting processes (default: all cores)")
+    parser.add_argument("--profile", choices=list(ANALYSIS_PROFILES), default=None,
+                        help="Analysis profile for a new database (default: 'default', or the one already stored)")
+    parser.add_argument("--keep-near-duplicates", action="store_true",
+                        help="Index songs that overlap strongly with an indexed one (exact copies are always skipped)")
+    args = parser.parse_args()
+
     if not os.path.exists(SONG_FOLDER):
         print(f"Folder '{SONG_FOLDER}' does not exist!")
     elif not os.listdir(SONG_FOLDER):
         print(f"Folder '{SONG_FOLDER}' is empty!")
     else:
-        build_database()
+        build_database(workers=args.workers, profile=args.profile, skip_near_duplicates=not args.keep_near_duplicates)
@@ -1,23 +1,306 @@
 # db_utils.py
 
+import json
+import os
 import sqlite3
+import uuid
+import numpy as np
+
+# Version 2: INTEGER hashes clustered by (hash, song_id, offset) in a WITHOUT ROWID table
+SCHEMA_VERSION = 2
+
+def get_schema_version(conn):
+    c = conn.cursor()
+    tables = {row[0] for row in c.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if "schema_version" in tables:
+        row = c.execute("SELECT version FROM schema_version").fetchone()
+        if row:
+            return row[0]
+    # Databases from before the version table always used the v1 (TEXT hash) layout
+    if "fingerprints" in tables:
+        return 1
+    return None
+
+def check_schema_version(conn):
+    # Older layouts have to be migrated first: their TEXT hashes never match an integer lookup
+    version = get_schema_version(conn)
+    if version is not None and version < SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database uses fingerprint schema v{version}, "
+            f"run 'python db_utils.py migrate' to upgrade it to v{SCHEMA_VERSION}")
+    return version
+
+def _set_schema_version(conn, version):
+    c = conn.cursor()
+    c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL);")
+    c.execute("DELETE FROM schema_version")
+    c.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+
+def _create_fingerprints_table(conn, name="fingerprints", foreign_key=True):
+    # Shard databases have no songs table to point the foreign key at
+    fk = ",\n            FOREIGN KEY(song_id) REFERENCES songs(id)" if foreign_key else ""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            hash INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            PRIMARY KEY (hash, song_id, offset){fk}
+        ) WITHOUT ROWID;
+        """)
+
+SONG_METADATA_COLUMNS = (
+    ("display_name", "TEXT"),
+    ("spotify_url", "TEXT"),
+    ("duration", "REAL"),            # seconds
+    ("fingerprint_count", "INTEGER"),
+    ("audio_hash", "TEXT"),          # SHA-1 of the decoded samples, finds re-uploads under another name
+)
 
 def create_tables_and_indices(conn):
+    version = check_schema_version(conn)
     c = conn.cursor()
+    # WAL lets recognitions read while an ingest is writing (the mode is stored in the file)
+    c.execute("PRAGMA journal_mode=WAL")
     c.execute("""
         CREATE TABLE IF NOT EXISTS songs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             filename TEXT UNIQUE);
             """)
+    # Song metadata (see songs_db.py), added to databases from before it moved out of songs_db.csv
+    columns = {row[1] for row in c.execute("PRAGMA main.table_info(songs)")}
+    for name, sql_type in SONG_METADATA_COLUMNS:
+        if name not in columns:
+            c.execute(f"ALTER TABLE songs ADD COLUMN {name} {sql_type}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_songs_audio_hash ON songs(audio_hash)")
+    # The primary key doubles as the hash index, no secondary indexes needed
+    _create_fingerprints_table(conn)
+    c.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT);")
+    # Pictures rendered at ingest time for the result page (see song_assets.py)
     c.execute("""
-        CREATE TABLE IF NOT EXISTS fingerprints (
-            hash TEXT,
-            offset INTEGER,
+        CREATE TABLE IF NOT EXISTS song_assets (
             song_id INTEGER,
-            FOREIGN KEY(song_id) REFERENCES songs(id));
+            kind TEXT,
+            data BLOB,
+            PRIMARY KEY (song_id, kind),
+            FOREIGN KEY(song_id) REFERENCES songs(id)
+        ) WITHOUT ROWID;
+        """)
+    # Posting counts per hash, kept up to date by add_fingerprints_bulk (see hash_stats.py)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS hash_stats (
+            hash INTEGER PRIMARY KEY,
+            postings INTEGER NOT NULL,
+            songs INTEGER NOT NULL,
+            capped INTEGER NOT NULL DEFAULT 0
+        );
         """)
-    c.execute("CREATE INDEX IF NOT EXISTS idx_hash ON fingerprints(hash);")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_song_id ON fingerprints(song_id);")
+    if version is None:
+        _set_schema_version(conn, SCHEMA_VERSION)
+    if get_meta(conn, "db_uuid") is None:
+        # Tells this database apart from an older or newer file at the same path (see get_db_uuid)
+        set_meta(conn, "db_uuid", uuid.uuid4().hex)
+    conn.commit()
+    attach_shards(conn)
+    if get_meta(conn, "hash_stats") is None:
+        # Database from before the statistics: count the stored fingerprints once
+        rebuild_hash_stats(conn)
+    if get_meta(conn, "fingerprint_counts") is None:
+        # Counts from before they were taken from the stored rows: recount them once
+        _recount_fingerprints(conn)
+
+# === Key/value settings stored in the database ===
+def get_meta(conn, key, default=None):
+    try:
+        row = conn.execute("SELECT value FROM main.db_meta WHERE key=?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        # Older databases have no db_meta table yet
+        return default
+    return row[0] if row else default
+
+def set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO main.db_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+def get_db_uuid(conn):
+    # Random id set when the database file is created; result caches key on it,
+    # generations alone do not tell a rebuilt file from the one it replaced
+    return get_meta(conn, "db_uuid")
+
+# === Analysis profile ===
+def get_analysis_profile(conn):
+    # (name, params) of the profile the songs were fingerprinted with (see fingerprinting.ANALYSIS_PROFILES).
+    # The stored parameters win over the table in the code, so queries keep matching the index.
+    from fingerprinting import DEFAULT_PROFILE, get_profile
+    name = get_meta(conn, "analysis_profile", DEFAULT_PROFILE)
+    params = get_meta(conn, "analysis_params")
+    return name, (json.loads(params) if params else get_profile(name))
+
+def set_analysis_profile(conn, name):
+    from fingerprinting import get_profile
+    set_meta(conn, "analysis_params", json.dumps(get_profile(name)))
+    set_meta(conn, "analysis_profile", name)
+
+def ensure_analysis_profile(conn, name=None):
+    """
+    Return the (name, params) to fingerprint new songs with. A database without
+    songs takes the requested profile; one with songs keeps its own, asking for
+    a different profile then is an error (every song would need a new fingerprint).
+    """
+    current, _ = get_analysis_profile(conn)
+    has_songs = conn.execute("SELECT 1 FROM songs LIMIT 1").fetchone() is not None
+    if not has_songs and (get_meta(conn, "analysis_params") is None or (name and name != current)):
+        set_analysis_profile(conn, name or current)
+        conn.commit()
+    elif name and name != current:
+        raise RuntimeError(
+            f"Database was fingerprinted with the '{current}' analysis profile, "
+            f"build a new database file to use '{name}'")
+    return get_analysis_profile(conn)
+
+# === Hash popularity and stop hashes ===
+# A hash found in more songs than the threshold of the stop-hash policy is a
+# "stop hash": its postings make every lookup fetch rows of many songs without
+# telling them apart. With query "exclude" recognition drops stop hashes before
+# the lookup. With index "cap" ingest stops storing postings for a hash once it
+# has reached the threshold and flags it as capped: its posting list is
+# incomplete for good, so queries always drop capped hashes, whatever the
+# policy or threshold is later. The policy is stored in db_meta.
+STOP_HASH_POLICY = {
+    "max_song_fraction": 0.03,  # share of all songs a hash may occur in...
+    "min_songs": 20,            # ...but never less than this many songs (small catalogues)
+    "query": "exclude",         # "exclude" or "keep"
+    "index": "keep",            # "keep" or "cap" (smaller index, songs made only of common hashes are lost)
+}
+
+def get_stop_hash_policy(conn):
+    policy = dict(STOP_HASH_POLICY)
+    stored = get_meta(conn, "stop_hash_policy")
+    if stored:
+        policy.update(json.loads(stored))
+    return policy
+
+def set_stop_hash_policy(conn, **changes):
+    policy = get_stop_hash_policy(conn)
+    policy.update({k: v for k, v in changes.items() if v is not None})
+    if policy["query"] not in ("exclude", "keep") or policy["index"] not in ("cap", "keep"):
+        raise ValueError(f"Invalid stop-hash policy: {policy}")
+    set_meta(conn, "stop_hash_policy", json.dumps(policy))
+    # Cached recognition results were computed with the old policy
+    bump_generation(conn)
+    conn.commit()
+    return policy
+
+def stop_hash_threshold(conn, policy=None):
+    # Hashes found in more songs than this are stop hashes
+    policy = policy or get_stop_hash_policy(conn)
+    n_songs = conn.execute("SELECT COUNT(*) FROM main.songs").fetchone()[0]
+    return max(int(policy["min_songs"]), int(policy["max_song_fraction"] * n_songs))
+
+def stop_hashes(conn):
+    """Sorted array of the hashes queries skip: the capped ones, plus those over the threshold with query "exclude"."""
+    try:
+        policy = get_stop_hash_policy(conn)
+        # songs > NULL never holds: with query "keep" only the capped hashes are left out
+        threshold = stop_hash_threshold(conn, policy) if policy["query"] == "exclude" else None
+        # A scan of hash_stats, callers keep the result until the generation changes
+        rows = conn.execute("SELECT hash FROM main.hash_stats WHERE capped OR songs > ? ORDER BY hash",
+                            (threshold,)).fetchall()
+    except sqlite3.OperationalError:
+        # Read-only connection to a database from before the statistics
+        return np.empty(0, dtype=np.int64)
+    return np.array([row[0] for row in rows], dtype=np.int64)
+
+def _hash_stats_rows(conn, hashes, batch_size=900):
+    # {hash: (songs, capped)} of the hashes that are counted already
+    rows = {}
+    for i in range(0, len(hashes), batch_size):
+        batch = hashes[i:i+batch_size]
+        for h, songs, capped in conn.execute(
+                f"SELECT hash, songs, capped FROM main.hash_stats WHERE hash IN ({','.join('?' * len(batch))})",
+                batch):
+            rows[h] = (songs, capped)
+    return rows
+
+def _record_hash_stats(conn, hashes, offsets):
+    # Count the fingerprints of one song in hash_stats. Returns the mask of the
+    # rows to store: with the index "cap" policy, hashes at the threshold are left out.
+    pairs = np.unique(np.stack([hashes, offsets], axis=1), axis=0)
+    unique_hashes, postings = np.unique(pairs[:, 0], return_counts=True)
+    policy = get_stop_hash_policy(conn)
+    threshold = stop_hash_threshold(conn, policy) if policy["index"] == "cap" else None
+    stats = _hash_stats_rows(conn, unique_hashes.tolist())
+    # A hash capped once stays capped, also after the policy went back to "keep"
+    capped = np.array([h in stats and (stats[h][1] or (threshold is not None and stats[h][0] >= threshold))
+                       for h in unique_hashes.tolist()], dtype=bool)
+    # postings counts the stored rows, songs every song that contains the hash
+    conn.executemany("""
+        INSERT INTO main.hash_stats (hash, postings, songs, capped) VALUES (?, ?, 1, ?)
+        ON CONFLICT(hash) DO UPDATE SET postings = postings + excluded.postings, songs = songs + 1,
+                                        capped = capped OR excluded.capped""",
+        zip(unique_hashes.tolist(), np.where(capped, 0, postings).tolist(), capped.astype(int).tolist()))
+    return ~np.isin(hashes, unique_hashes[capped])
+
+def rebuild_hash_stats(conn):
+    # Recount hash_stats from the stored fingerprints. The songs of capped hashes
+    # were not stored, so their old counts and the capped flag are kept.
+    conn.execute("DROP TABLE IF EXISTS temp.capped_hashes")
+    conn.execute("CREATE TEMP TABLE capped_hashes AS SELECT hash, songs FROM main.hash_stats WHERE capped")
+    conn.execute("DELETE FROM main.hash_stats")
+    for table in fingerprint_tables(conn):
+        # Every hash lives in one shard only, the groups of the tables never overlap
+        conn.execute(f"""
+            INSERT INTO main.hash_stats (hash, postings, songs)
+            SELECT hash, COUNT(*), COUNT(DISTINCT song_id) FROM {table} GROUP BY hash""")
+    conn.execute("""
+        INSERT INTO main.hash_stats (hash, postings, songs, capped)
+        SELECT hash, 0, songs, 1 FROM temp.capped_hashes WHERE true
+        ON CONFLICT(hash) DO UPDATE SET songs = MAX(songs, excluded.songs), capped = 1""")
+    conn.execute("DROP TABLE temp.capped_hashes")
+    set_meta(conn, "hash_stats", 1)
+    conn.commit()
+
+# === Hash-prefix sharding ===
+# With shard_count > 1 the fingerprints live in N extra SQLite files next to the
+# main database (music_fingerprints.shard0.db, ...), partitioned by the top bits
+# of a mixed hash. The main file keeps the songs and an empty fingerprints table.
+MAX_SHARDS = 10  # SQLite attaches at most 10 databases to one connection by default
+
+def get_shard_count(conn):
+    return int(get_meta(conn, "shard_count", 1))
+
+def shard_paths(db_file, shard_count):
+    base = os.path.splitext(db_file)[0]
+    return [f"{base}.shard{i}.db" for i in range(shard_count)]
+
+def shard_of(hashes, shard_count):
+    # Multiplicative mixing first, so neighbouring hashes (same f1) spread over all shards
+    mixed = (np.asarray(hashes, dtype=np.uint64) * np.uint64(2654435761)) & np.uint64(0xFFFFFFFF)
+    return ((mixed * np.uint64(shard_count)) >> np.uint64(32)).astype(np.int64)
+
+def fingerprint_tables(conn):
+    # Every table that holds fingerprints, for readers that need all of them
+    shard_count = get_shard_count(conn)
+    if shard_count > 1:
+        return [f"shard{i}.fingerprints" for i in range(shard_count)]
+    return ["fingerprints"]
+
+def main_db_file(conn):
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return None
+
+def attach_shards(conn, shard_count=None):
+    # Writers see the shards as shard0.fingerprints, shard1.fingerprints, ...
+    if shard_count is None:
+        shard_count = get_shard_count(conn)
+    if shard_count <= 1:
+        return
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    for i, path in enumerate(shard_paths(main_db_file(conn), shard_count)):
+        if f"shard{i}" not in attached:
+            conn.execute("ATTACH DATABASE ? AS ?", (path, f"shard{i}"))
+            conn.execute(f"PRAGMA shard{i}.journal_mode=WAL")
+            _create_fingerprints_table(conn, f"shard{i}.fingerprints", foreign_key=False)
     conn.commit()
 
 def song_in_db(conn, filename):
@@ -26,25 +309,310 @@ def song_in_db(conn, filename):
     row = c.fetchone()
     return row[0] if row else None
 
-def add_song_to_db(conn, filename):
+def song_by_audio_hash(conn, audio_hash):
+    # (id, filename) of the song with exactly the same decoded audio, or None
+    return conn.execute("SELECT id, filename FROM songs WHERE audio_hash=?", (audio_hash,)).fetchone()
+
+def bump_counter(conn, key):
+    conn.execute(
+        "INSERT INTO main.db_meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1", (key,))
+
+def bump_generation(conn):
+    # Counts changes to the song catalogue; cached query results of an older generation are stale
+    bump_counter(conn, "generation")
+
+def get_generation(conn):
+    return int(get_meta(conn, "generation", 0))
+
+def add_song_to_db(conn, filename, commit=True, display_name=None, spotify_url=None, duration=None,
+                   fingerprint_count=None, audio_hash=None):
     c = conn.cursor()
-    c.execute("INSERT INTO songs (filename) VALUES (?)", (filename,))
-    conn.commit()
+    c.execute("""
+        INSERT INTO songs (filename, display_name, spotify_url, duration, fingerprint_count, audio_hash)
+        VALUES (?, ?, ?, ?, ?, ?)""", (filename, display_name, spotify_url, duration, fingerprint_count, audio_hash))
+    bump_generation(conn)
+    # In-process metadata caches compare this counter (songs_db.py)
+    bump_counter(conn, "songs_version")
+    if commit:
+        conn.commit()
     return c.lastrowid
 
-def add_fingerprints_bulk(conn, song_id, fingerprints, batch_size=2000):
+def save_song_assets(conn, song_id, assets, commit=True):
+    # assets: kind -> bytes, replaces pictures of the same kind
+    conn.executemany("INSERT OR REPLACE INTO song_assets (song_id, kind, data) VALUES (?, ?, ?)",
+                     [(song_id, kind, sqlite3.Binary(data)) for kind, data in assets.items()])
+    if commit:
+        conn.commit()
+
+def add_fingerprints_bulk(conn, song_id, hashes, offsets, batch_size=2000, commit=True):
+    # All fingerprints of one song at once: hash_stats counts every call as one song.
+    # Returns the number of rows stored, also kept as the song's fingerprint_count.
     c = conn.cursor()
-    # SAFETY: Always insert plain int for offset, str for hash
-    records = []
-    for h, t in fingerprints:
-        # If hash is bytes, decode
-        if isinstance(h, bytes):
-            h = h.decode("utf-8")
-        h = str(h)
-        # Always ensure int (not np.int64 etc)
-        t = int(t)
-        records.append((h, t, song_id))
-    for i in range(0, len(records), batch_size):
-        batch = records[i:i+batch_size]
-        c.executemany("INSERT INTO fingerprints (hash, offset, song_id) VALUES (?, ?, ?)", batch)
+    stored_rows = 0
+    hashes = np.asarray(hashes, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(hashes):
+        stored = _record_hash_stats(conn, hashes, offsets)
+        hashes, offsets = hashes[stored], offsets[stored]
+    # Route every row to its shard (one table when the database is not sharded)
+    shard_count = get_shard_count(conn)
+    if shard_count > 1:
+        shards = shard_of(hashes, shard_count)
+        targets = [(f"shard{i}.fingerprints", shards == i) for i in range(shard_count)]
+    else:
+        targets = [("fingerprints", slice(None))]
+    for table, rows in targets:
+        # SAFETY: Always insert plain Python ints (not np.uint32 / np.int32)
+        records = list(zip(
+            hashes[rows].tolist(),
+            (song_id for _ in range(len(hashes[rows]))),
+            offsets[rows].tolist(),
+        ))
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i+batch_size]
+            # The same (hash, offset) can show up twice in one song, store it once
+            c.executemany(f"INSERT OR IGNORE INTO {table} (hash, song_id, offset) VALUES (?, ?, ?)", batch)
+            stored_rows += c.rowcount
+    # find_torn_songs() compares it with the rows found in the fingerprint tables
+    c.execute("UPDATE main.songs SET fingerprint_count = ? WHERE id = ?", (stored_rows, song_id))
+    if commit:
+        conn.commit()
+    return stored_rows
+
+def _stored_fingerprint_counts(conn):
+    # {song_id: rows in the fingerprint tables}
+    counts = {}
+    for table in fingerprint_tables(conn):
+        for song_id, n in conn.execute(f"SELECT song_id, COUNT(*) FROM {table} GROUP BY song_id"):
+            counts[song_id] = counts.get(song_id, 0) + n
+    return counts
+
+def _recount_fingerprints(conn):
+    conn.executemany("UPDATE songs SET fingerprint_count = ? WHERE id = ?",
+                     [(n, song_id) for song_id, n in _stored_fingerprint_counts(conn).items()])
+    set_meta(conn, "fingerprint_counts", 1)
+    bump_counter(conn, "songs_version")
+    conn.commit()
+
+def find_torn_songs(conn):
+    """
+    Sharded databases are in WAL mode, where a commit is atomic per file only:
+    a crash while a song is added can leave its row without all of its
+    fingerprints, or fingerprints without a song row. Returns (torn, orphans):
+    ids of songs whose fingerprint_count differs from their stored rows, and
+    song ids that have fingerprints but no row in songs.
+    """
+    stored = _stored_fingerprint_counts(conn)
+    counts = dict(conn.execute("SELECT id, fingerprint_count FROM songs"))
+    torn = sorted(song_id for song_id, count in counts.items() if stored.get(song_id, 0) != count)
+    orphans = sorted(set(stored) - set(counts))
+    return torn, orphans
+
+def remove_songs(conn, song_ids):
+    # Delete songs with their fingerprints and pictures, then recount hash_stats.
+    # Not atomic across shards either; running find_torn_songs() again shows what is left.
+    if not song_ids:
+        return
+    ids = ",".join(str(int(song_id)) for song_id in song_ids)
+    for table in fingerprint_tables(conn):
+        conn.execute(f"DELETE FROM {table} WHERE song_id IN ({ids})")
+    conn.execute(f"DELETE FROM song_assets WHERE song_id IN ({ids})")
+    conn.execute(f"DELETE FROM songs WHERE id IN ({ids})")
+    bump_generation(conn)
+    bump_counter(conn, "songs_version")
+    conn.commit()
+    rebuild_hash_stats(conn)
+
+def _remove_db_files(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def reshard(db_file, shard_count, batch_size=500000):
+    """
+    Repartition the fingerprints of db_file over shard_count shard files
+    (1 = everything back in the single main file). Songs keep their ids.
+    """
+    if not 1 <= shard_count <= MAX_SHARDS:
+        raise ValueError(f"shard count must be between 1 and {MAX_SHARDS}")
+    conn = sqlite3.connect(db_file)
+    create_tables_and_indices(conn)
+    old_count = get_shard_count(conn)
+
+    # 1. Gather all fingerprints back into the main file
+    if old_count > 1:
+        for i in range(old_count):
+            conn.execute(f"INSERT OR IGNORE INTO main.fingerprints SELECT hash, song_id, offset FROM shard{i}.fingerprints")
+        set_meta(conn, "shard_count", 1)
+        conn.commit()
+        for i in range(old_count):
+            conn.execute(f"DETACH DATABASE shard{i}")
+        for path in shard_paths(db_file, old_count):
+            _remove_db_files(path)
+
+    # 2. Spread them over the new shard files in one pass
+    if shard_count > 1:
+        for path in shard_paths(db_file, shard_count):
+            _remove_db_files(path)  # leftovers of an interrupted run
+        attach_shards(conn, shard_count)
+        read = conn.cursor()
+        write = conn.cursor()
+        read.execute("SELECT hash, song_id, offset FROM main.fingerprints")
+        while True:
+            rows = read.fetchmany(batch_size)
+            if not rows:
+                break
+            block = np.array(rows, dtype=np.int64)
+            shards = shard_of(block[:, 0], shard_count)
+            for i in range(shard_count):
+                write.executemany(f"INSERT OR IGNORE INTO shard{i}.fingerprints (hash, song_id, offset) VALUES (?, ?, ?)",
+                                  block[shards == i].tolist())
+        # The main file only switches to the shards once they hold all rows
+        write.execute("DELETE FROM main.fingerprints")
+        set_meta(conn, "shard_count", shard_count)
+        conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+# === Migration from the v1 schema ===
+def _legacy_int(value):
+    # v1 databases could hold values as int, numpy bytes or text.
+    # 20-character SHA-1 hex hashes are never valid packed integers.
+    if isinstance(value, int):
+        return value
+    if isinstance(value, bytes):
+        return int.from_bytes(value, byteorder="little", signed=True)
+    if isinstance(value, str) and value.isdigit() and len(value) <= 10:
+        return int(value)
+    return None
+
+def _refingerprint_song(path):
+    from audio_cache import load_audio
+    from fingerprinting import preprocess_audio, get_peaks, generate_fingerprints
+    y, sr = load_audio(path)
+    y, sr = preprocess_audio(y, sr)
+    return generate_fingerprints(get_peaks(y, sr))
+
+def migrate_v1_to_v2(conn, song_folder="music_wavs", batch_size=50000):
+    """
+    Convert a v1 database (TEXT hashes, rowid table, two indexes) to v2 in place.
+    Rows that already hold packed integer hashes are copied over; songs that were
+    indexed with the old SHA-1 hashes are fingerprinted again from song_folder.
+    """
+    version = get_schema_version(conn)
+    if version is None or version >= SCHEMA_VERSION:
+        print(f"Nothing to migrate (schema version: {version}).")
+        return False
+
     conn.commit()
+    conn.execute("BEGIN")
+    _create_fingerprints_table(conn, "fingerprints_v2")
+    read = conn.cursor()
+    write = conn.cursor()
+    read.execute("SELECT hash, song_id, offset FROM fingerprints")
+    legacy_songs = set()
+    copied_songs = set()
+    copied = 0
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        records = []
+        for h, song_id, offset in rows:
+            h, offset = _legacy_int(h), _legacy_int(offset)
+            if h is None or offset is None:
+                legacy_songs.add(song_id)
+                continue
+            records.append((h, song_id, offset))
+            copied_songs.add(song_id)
+        write.executemany(
+            "INSERT OR IGNORE INTO fingerprints_v2 (hash, song_id, offset) VALUES (?, ?, ?)", records)
+        copied += len(records)
+    print(f"  Copied {copied} integer fingerprints.")
+
+    for song_id in sorted(legacy_songs):
+        if song_id in copied_songs:
+            # Song with integer and SHA-1 rows: it is fingerprinted again as a whole
+            write.execute("DELETE FROM fingerprints_v2 WHERE song_id=?", (song_id,))
+        row = write.execute("SELECT filename FROM songs WHERE id=?", (song_id,)).fetchone()
+        filename = row[0] if row else None
+        path = os.path.join(song_folder, filename) if filename else None
+        if path and os.path.exists(path):
+            print(f"  Re-fingerprinting legacy song: {filename}")
+            hashes, offsets = _refingerprint_song(path)
+            write.executemany(
+                "INSERT OR IGNORE INTO fingerprints_v2 (hash, song_id, offset) VALUES (?, ?, ?)",
+                zip(hashes.tolist(), (song_id for _ in range(len(hashes))), offsets.tolist()))
+        else:
+            # Without the audio there is no way to rebuild the hashes, drop the song
+            print(f"  ⚠️ Audio for legacy song {filename!r} not found, removing it from the database.")
+            write.execute("DELETE FROM songs WHERE id=?", (song_id,))
+
+    # Dropping the table also drops idx_hash and idx_song_id
+    write.execute("DROP TABLE fingerprints")
+    write.execute("ALTER TABLE fingerprints_v2 RENAME TO fingerprints")
+    _set_schema_version(conn, SCHEMA_VERSION)
+    conn.commit()
+    # Give the space of the old table and indexes back to the file system
+    conn.execute("VACUUM")
+    return True
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fingerprint database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Upgrade a v1 database to the current schema in place")
+    migrate.add_argument("--db", default="music_fingerprints.db")
+    migrate.add_argument("--songs", default="music_wavs", help="Folder with the indexed audio files")
+    resharding = sub.add_parser("reshard", help="Split the fingerprints over N shard files (1 = single file)")
+    resharding.add_argument("--db", default="music_fingerprints.db")
+    resharding.add_argument("--shards", type=int, required=True, help=f"Number of shards (1-{MAX_SHARDS})")
+    checking = sub.add_parser("check", help="Find songs left incomplete by a crash during an ingest")
+    checking.add_argument("--db", default="music_fingerprints.db")
+    checking.add_argument("--repair", action="store_true", help="Remove those songs so they can be added again")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        if not os.path.exists(args.db):
+            print(f"Database '{args.db}' does not exist!")
+        else:
+            conn = sqlite3.connect(args.db)
+            create_tables_and_indices(conn)
+            torn, orphans = find_torn_songs(conn)
+            if not torn and not orphans:
+                print("✅ Every song has all of its fingerprints.")
+            else:
+                names = dict(conn.execute("SELECT id, filename FROM songs"))
+                for song_id in torn:
+                    print(f"⚠️ Incomplete: {names[song_id]} (id {song_id})")
+                if orphans:
+                    print(f"⚠️ Fingerprints without a song: ids {', '.join(map(str, orphans))}")
+                if args.repair:
+                    remove_songs(conn, torn + orphans)
+                    print(f"Removed {len(torn)} incomplete song(s), add them again with build_database.py.")
+                else:
+                    print("Run again with --repair to remove them.")
+            conn.close()
+
+    if args.command == "reshard":
+        if not os.path.exists(args.db):
+            print(f"Database '{args.db}' does not exist!")
+        elif not 1 <= args.shards <= MAX_SHARDS:
+            print(f"The number of shards must be between 1 and {MAX_SHARDS}.")
+        else:
+            reshard(args.db, args.shards)
+            print(f"Resharded {args.db} into {args.shards} shard(s).")
+
+    if args.command == "migrate":
+        if not os.path.exists(args.db):
+            print(f"Database '{args.db}' does not exist!")
+        else:
+            before = os.path.getsize(args.db)
+            conn = sqlite3.connect(args.db)
+            if migrate_v1_to_v2(conn, args.songs):
+                after = os.path.getsize(args.db)
+                print(f"Migrated {args.db} to schema v{SCHEMA_VERSION}: "
+                      f"{before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+            conn.close()
@@ -1,10 +1,42 @@
 import numpy as np
 import librosa
-import hashlib
+import soundfile as sf
+import soxr
 from scipy.ndimage import maximum_filter
+from metrics import stage
 
 #This script includes three funtions that can be used in the process of fingerprinting
 
+# === Analysis profiles ===
+# Everything that shapes the fingerprints: sample rate, STFT, peak picking and
+# pairing. A database stores the profile its songs were fingerprinted with
+# (db_utils.get_analysis_profile) and queries always use that one.
+# The lower rates keep the bin width (~21.5 Hz) and frame length (~5.8 ms) of
+# "default", so neighbourhood and dt limits mean the same; they only drop the
+# frequencies above sr / 2 and cost a fraction of the STFT.
+ANALYSIS_PROFILES = {
+    "default": {"sr": 44100, "n_fft": 2048, "hop_length": 256, "neighborhood": (25, 18), "min_db": -65,
+                "peaks_per_frame": 5, "fan_value": 5, "min_dt": 5, "max_dt": 200},
+    "medium": {"sr": 22050, "n_fft": 1024, "hop_length": 128, "neighborhood": (25, 18), "min_db": -65,
+               "peaks_per_frame": 5, "fan_value": 5, "min_dt": 5, "max_dt": 200},
+    "low": {"sr": 11025, "n_fft": 512, "hop_length": 64, "neighborhood": (25, 18), "min_db": -65,
+            "peaks_per_frame": 5, "fan_value": 5, "min_dt": 5, "max_dt": 200},
+}
+DEFAULT_PROFILE = "default"
+
+def get_profile(name=DEFAULT_PROFILE):
+    if name not in ANALYSIS_PROFILES:
+        raise ValueError(f"Unknown analysis profile: {name!r} (expected one of {tuple(ANALYSIS_PROFILES)})")
+    return dict(ANALYSIS_PROFILES[name])
+
+def peak_params(params):
+    # The get_peaks() keyword arguments of a profile
+    return {key: params[key] for key in ("peaks_per_frame", "n_fft", "hop_length", "neighborhood", "min_db")}
+
+def pair_params(params):
+    # The generate_fingerprints() keyword arguments of a profile
+    return {key: params[key] for key in ("fan_value", "min_dt", "max_dt")}
+
 def preprocess_audio(y, sr, target_sr=44100, target_rms=0.1):
     # 1. Resample to target sample rate
     if sr != target_sr:
@@ -29,39 +61,228 @@ def preprocess_audio(y, sr, target_sr=44100, target_rms=0.1):
 
     return y, sr
 
-def get_peaks(y, sr):
-    S = np.abs(librosa.stft(y, n_fft=2048, hop_length=256))
-    S_db = librosa.amplitude_to_db(S, ref=np.max)
-
-    # Lower dB threshold, bigger local_max window for more tolerance
-    local_max = maximum_filter(S_db, size=(25, 18)) == S_db
-    detected_peaks = np.argwhere(local_max & (S_db > -65))
-
-    peaks_by_time = {}
-    for f, t in detected_peaks:
-        peaks_by_time.setdefault(t, []).append((f, t))
-    # Allow up to 12 strongest peaks per time slice (was 7)
-    strong_peaks = []
-    for t, plist in peaks_by_time.items():
-        plist.sort(key=lambda x: S_db[x[0], x[1]], reverse=True)
-        strong_peaks.extend(plist[:5])
-    return strong_peaks
-
-def generate_fingerprints(peaks, fan_value=5):
-    fingerprints = []
-    peaks = sorted(peaks, key=lambda x: x[1])  # sort by time
-    for i in range(len(peaks)):
-        for j in range(1, fan_value):
-            if i + j < len(peaks):
-                f1, t1 = peaks[i]
-                f2, t2 = peaks[i + j]
-                dt = t2 - t1
-                # Only accept pairs within a reasonable time difference
-                if 5 < dt <= 200:
-                    # Quantize values to make fingerprinting more robust to noise
-                    quant_f1 = int(f1 / 2)
-                    quant_f2 = int(f2 / 2)
-                    quant_dt = int(dt / 2)
-                    h = hashlib.sha1(f"{quant_f1}|{quant_f2}|{quant_dt}".encode()).hexdigest()[:20]
-                    fingerprints.append((h, t1))
-    return fingerprints
\ No newline at end of file
+def get_peaks(y, sr, peaks_per_frame=5, timer=None, n_fft=2048, hop_length=256, neighborhood=(25, 18), min_db=-65):
+    # Keep the STFT in float32 (complex64), this halves memory on long songs
+    y = np.asarray(y, dtype=np.float32)
+    with stage(timer, "stft"):
+        S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+        S_db = librosa.amplitude_to_db(S, ref=np.max).astype(np.float32, copy=False)
+        del S
+
+    with stage(timer, "peak_picking"):
+        # Lower dB threshold, bigger local_max window for more tolerance
+        local_max = maximum_filter(S_db, size=tuple(neighborhood)) == S_db
+        candidates = np.where(local_max & (S_db > min_db), S_db, -np.inf)
+        del local_max
+        freqs, frames = _strongest_per_frame(candidates, peaks_per_frame)
+    # Compact (freq, frame) int array, sorted by frame
+    return np.stack([freqs, frames], axis=1).astype(np.int32)
+
+def _strongest_per_frame(candidates, peaks_per_frame):
+    # candidates: spectrogram with -inf everywhere except at the detected peaks
+    n_freqs, n_frames = candidates.shape
+    if n_frames == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Keep only the strongest peaks of each time frame (per-column partial selection)
+    k = min(peaks_per_frame, n_freqs)
+    top = np.argpartition(candidates, n_freqs - k, axis=0)[n_freqs - k:]
+    top_vals = np.take_along_axis(candidates, top, axis=0)
+
+    # Strongest first inside each frame, then flatten frame by frame
+    order = np.argsort(-top_vals, axis=0, kind="stable")
+    top = np.take_along_axis(top, order, axis=0)
+    top_vals = np.take_along_axis(top_vals, order, axis=0)
+    frames = np.broadcast_to(np.arange(n_frames), top.shape)
+    keep = np.isfinite(top_vals).T.ravel()
+    return top.T.ravel()[keep], frames.T.ravel()[keep]
+
+# Bit layout of the packed integer hash: quant_f1 | quant_f2 | quant_dt
+FREQ_BITS = 10
+DT_BITS = 7
+# Bump whenever peaks or hashes change: cached recognition results depend on it
+FINGERPRINT_VERSION = 2
+
+def generate_fingerprints(peaks, fan_value=5, min_dt=5, max_dt=200):
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+    # Sort by time (stable, so the strongest peak of a frame stays first)
+    peaks = peaks[np.argsort(peaks[:, 1], kind="stable")]
+    return _pair_hashes(peaks[:, 0], peaks[:, 1], fan_value, min_dt, max_dt)
+
+def fingerprint_samples(y, sr, params=None, timer=None):
+    """
+    Preprocess + peaks + hashes of decoded audio with the parameters of an
+    analysis profile (default profile if None): (n_peaks, hashes, offsets).
+    """
+    params = params or get_profile()
+    with stage(timer, "preprocess"):
+        y, sr = preprocess_audio(y, sr, target_sr=params["sr"])
+    peaks = get_peaks(y, sr, timer=timer, **peak_params(params))
+    with stage(timer, "hashing"):
+        hashes, offsets = generate_fingerprints(peaks, **pair_params(params))
+    return len(peaks), hashes, offsets
+
+def _pair_hashes(freqs, times, fan_value=5, min_dt=5, max_dt=200, first_new=0):
+    # Pairs (i, i + j) whose second peak comes before first_new were already hashed
+    n = len(freqs)
+    hashes = []
+    offsets = []
+    # Build all fan-out pairs (i, i + j) at once, one shift j at a time
+    for j in range(1, fan_value):
+        start = max(0, first_new - j)
+        if start + j >= n:
+            continue
+        f1, t1 = freqs[start:n-j], times[start:n-j]
+        f2, t2 = freqs[start+j:], times[start+j:]
+        dt = t2 - t1
+        # Only accept pairs within a reasonable time difference
+        ok = (dt > min_dt) & (dt <= max_dt)
+        # Quantize values to make fingerprinting more robust to noise
+        quant_f1 = f1[ok] // 2
+        quant_f2 = f2[ok] // 2
+        quant_dt = dt[ok] // 2
+        # Pack losslessly into one 32-bit integer
+        hashes.append((quant_f1 << (FREQ_BITS + DT_BITS)) | (quant_f2 << DT_BITS) | quant_dt)
+        offsets.append(t1[ok])
+
+    if not hashes:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    return np.concatenate(hashes).astype(np.uint32), np.concatenate(offsets).astype(np.int32)
+
+# === Streaming fingerprinting for long recordings ===
+# Files longer than this are fingerprinted block by block instead of loaded whole
+STREAMING_MIN_SECONDS = 600
+
+class StreamingFingerprinter:
+    """
+    Incremental version of get_peaks + generate_fingerprints for audio that
+    arrives in blocks. feed() returns the (hashes, offsets) that became final,
+    with offsets in absolute frames since the start of the stream; flush()
+    returns the rest after the last block. Memory stays bounded by the block size.
+
+    Differences to the whole-file path: there is no silence trim (offsets only
+    shift, which does not change the match) and the -65 dB threshold is taken
+    relative to the loudest frame seen so far instead of the whole song.
+    """
+
+    def __init__(self, sr, target_sr=44100, n_fft=2048, hop_length=256, neighborhood=(25, 18),
+                 min_db=-65, peaks_per_frame=5, fan_value=5, min_dt=5, max_dt=200):
+        self.sr = target_sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.neighborhood = tuple(neighborhood)
+        self.min_db = min_db
+        self.peaks_per_frame = peaks_per_frame
+        self.fan_value = fan_value
+        self.min_dt = min_dt
+        self.max_dt = max_dt
+        self.resampler = soxr.ResampleStream(sr, target_sr, 1, dtype="float32") if sr != target_sr else None
+        # Same zero padding as librosa.stft(center=True), so frame numbers match get_peaks
+        self.samples = np.zeros(n_fft // 2, dtype=np.float32)
+        # Log-magnitude columns: final frames kept as filter context + frames not final yet
+        self.spec = np.empty((n_fft // 2 + 1, 0), dtype=np.float32)
+        self.spec_start = 0   # absolute frame of self.spec[:, 0]
+        self.next_final = 0   # absolute frame of the first frame that is not final yet
+        self.ref_db = -np.inf  # running maximum, stands in for ref=np.max
+        # Last peaks, still waiting for their fan-out partners
+        self.carry = np.empty((0, 2), dtype=np.int64)
+        self.n_peaks = 0
+
+    def feed(self, y):
+        y = np.asarray(y, dtype=np.float32)
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        if self.resampler is not None:
+            y = self.resampler.resample_chunk(y)
+        self.samples = np.concatenate([self.samples, y])
+        return self._process(final=False)
+
+    def flush(self):
+        tail = [self.samples]
+        if self.resampler is not None:
+            tail.append(self.resampler.resample_chunk(np.empty(0, dtype=np.float32), last=True))
+        tail.append(np.zeros(self.n_fft // 2, dtype=np.float32))
+        self.samples = np.concatenate(tail)
+        return self._process(final=True)
+
+    @classmethod
+    def from_profile(cls, sr, params=None):
+        params = params or get_profile()
+        return cls(sr, target_sr=params["sr"], **peak_params(params), **pair_params(params))
+
+    def fingerprint_blocks(self, blocks):
+        # Generator over an iterable of sample blocks, ends with flush()
+        for block in blocks:
+            hashes, offsets = self.feed(block)
+            if len(hashes):
+                yield hashes, offsets
+        hashes, offsets = self.flush()
+        if len(hashes):
+            yield hashes, offsets
+
+    def _process(self, final):
+        n_fft, hop = self.n_fft, self.hop_length
+        # STFT over all complete frames, keep the overlapping tail for the next block
+        n_new = 0 if len(self.samples) < n_fft else 1 + (len(self.samples) - n_fft) // hop
+        if n_new:
+            S = np.abs(librosa.stft(self.samples[:(n_new - 1) * hop + n_fft],
+                                    n_fft=n_fft, hop_length=hop, center=False))
+            self.samples = self.samples[n_new * hop:]
+            S_db = (20 * np.log10(np.maximum(S, 1e-5))).astype(np.float32)
+            self.ref_db = max(self.ref_db, float(S_db.max()))
+            self.spec = np.concatenate([self.spec, S_db], axis=1)
+
+        # A frame is final once the local-max window has all its right-hand neighbours
+        t_size = self.neighborhood[1]
+        left, right = t_size // 2, t_size - 1 - t_size // 2
+        first = self.next_final - self.spec_start
+        last = self.spec.shape[1] if final else self.spec.shape[1] - right
+        if last <= first:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+
+        local_max = maximum_filter(self.spec, size=self.neighborhood) == self.spec
+        window = self.spec[:, first:last]
+        candidates = np.where(local_max[:, first:last] & (window > self.ref_db + self.min_db), window, -np.inf)
+        freqs, frames = _strongest_per_frame(candidates, self.peaks_per_frame)
+        frames = frames + self.next_final
+        self.next_final = self.spec_start + last
+
+        # Drop columns that no pending frame needs as context anymore
+        keep_from = max(0, last - left)
+        self.spec = self.spec[:, keep_from:]
+        self.spec_start += keep_from
+
+        # Pair the new peaks with each other and with the carried-over ones
+        self.n_peaks += len(freqs)
+        peaks = np.concatenate([self.carry, np.stack([freqs, frames], axis=1).astype(np.int64)])
+        hashes, offsets = _pair_hashes(peaks[:, 0], peaks[:, 1], self.fan_value, self.min_dt, self.max_dt,
+                                       first_new=len(self.carry))
+        self.carry = peaks[-(self.fan_value - 1):] if self.fan_value > 1 else peaks[:0]
+        return hashes, offsets
+
+def audio_duration(path):
+    # Duration in seconds from the file header, None if soundfile can't read it
+    try:
+        return sf.info(path).duration
+    except Exception:
+        return None
+
+def stream_fingerprints(path, block_seconds=30.0, fingerprinter=None, params=None):
+    """
+    Yield (hashes, offsets) for an audio file of any length, decoding it block
+    by block. Offsets are absolute frames from the start of the file.
+    """
+    sr = sf.info(path).samplerate
+    if fingerprinter is None:
+        fingerprinter = StreamingFingerprinter.from_profile(sr, params)
+    blocks = sf.blocks(path, blocksize=int(block_seconds * sr), dtype="float32", always_2d=True)
+    yield from fingerprinter.fingerprint_blocks(blocks)
+
+def fingerprint_file_streaming(path, block_seconds=30.0, params=None):
+    # Returns (n_peaks, hashes, offsets) like the whole-file path
+    fingerprinter = StreamingFingerprinter.from_profile(sf.info(path).samplerate, params)
+    parts = list(stream_fingerprints(path, block_seconds, fingerprinter))
+    if not parts:
+        return fingerprinter.n_peaks, np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    hashes, offsets = zip(*parts)
+    return fingerprinter.n_peaks, np.concatenate(hashes), np.concatenate(offsets)
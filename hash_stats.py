@@ -0,0 +1,114 @@
+# hash_stats.py
+# How often every fingerprint hash occurs (the hash_stats table, kept up to date
+# at ingest by db_utils.add_fingerprints_bulk) and the stop-hash policy built on it.
+
+import os
+import sqlite3
+import numpy as np
+
+from db_utils import (create_tables_and_indices, get_stop_hash_policy, set_stop_hash_policy, stop_hash_threshold,
+                      rebuild_hash_stats)
+from fingerprinting import FREQ_BITS, DT_BITS
+
+DB_FILE = "music_fingerprints.db"
+# Buckets of "number of songs that contain the hash" for the report
+SONG_BUCKETS = ((1, 1), (2, 2), (3, 5), (6, 10), (11, 20), (21, 50), (51, 100), (101, 500), (501, None))
+
+def unpack_hash(h):
+    # (f1 bin, f2 bin, dt frames) of a packed hash, see fingerprinting._pair_hashes
+    f1 = h >> (FREQ_BITS + DT_BITS)
+    f2 = (h >> DT_BITS) & ((1 << FREQ_BITS) - 1)
+    dt = h & ((1 << DT_BITS) - 1)
+    return int(f1) * 2, int(f2) * 2, int(dt) * 2
+
+def rows_per_fingerprint(postings):
+    # A query fingerprint hits a hash about as often as the hash is stored, so it
+    # fetches sum(p^2) / sum(p) rows on average
+    postings = np.asarray(postings, dtype=np.float64)
+    return float((postings ** 2).sum() / postings.sum()) if postings.sum() else 0.0
+
+def hash_report(conn, top=10):
+    rows = np.array(conn.execute("SELECT hash, postings, songs, capped FROM hash_stats").fetchall(), dtype=np.int64)
+    if len(rows) == 0:
+        rows = np.empty((0, 4), dtype=np.int64)
+    hashes, postings, songs, capped = rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3].astype(bool)
+    policy = get_stop_hash_policy(conn)
+    threshold = stop_hash_threshold(conn, policy)
+    # Same rule as db_utils.stop_hashes
+    stop = capped | ((songs > threshold) if policy["query"] == "exclude" else False)
+    buckets = []
+    for low, high in SONG_BUCKETS:
+        in_bucket = (songs >= low) & (songs <= high if high else True)
+        buckets.append({"songs": f"{low}" if low == high else f"{low}-{high or ''}",
+                        "hashes": int(in_bucket.sum()), "postings": int(postings[in_bucket].sum())})
+    order = np.argsort(-songs, kind="stable")[:top]
+    return {
+        "songs": conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0],
+        "hashes": len(rows),
+        "postings": int(postings.sum()),
+        "buckets": buckets,
+        "policy": policy,
+        "threshold": threshold,
+        "stop_hashes": int(stop.sum()),
+        "capped_hashes": int(capped.sum()),
+        "stop_postings": int(postings[stop].sum()),
+        "rows_per_fingerprint": rows_per_fingerprint(postings),
+        "rows_per_fingerprint_without_stop": rows_per_fingerprint(postings[~stop]),
+        "top": [(int(hashes[i]), int(songs[i]), int(postings[i])) for i in order],
+    }
+
+def print_report(report):
+    total = max(report["postings"], 1)
+    print(f"{report['songs']} songs, {report['hashes']:,} distinct hashes, {report['postings']:,} postings")
+    print("\nSongs per hash   Hashes       Postings")
+    for b in report["buckets"]:
+        print(f"  {b['songs']:<12} {b['hashes']:>10,} {b['postings']:>12,} ({b['postings'] / total:6.1%})")
+    policy = report["policy"]
+    print(f"\nStop-hash policy: queries {policy['query']}, index {policy['index']}, threshold "
+          f"{report['threshold']} songs (max({policy['min_songs']}, {policy['max_song_fraction']:.0%} of the songs))")
+    print(f"  {report['stop_hashes']:,} stop hashes hold {report['stop_postings']:,} postings "
+          f"({report['stop_postings'] / total:.1%}), {report['capped_hashes']:,} of them capped at ingest")
+    print(f"  Rows fetched per query fingerprint: {report['rows_per_fingerprint']:.2f} with all hashes, "
+          f"{report['rows_per_fingerprint_without_stop']:.2f} without stop hashes")
+    print("\nMost common hashes (f1 bin, f2 bin, dt frames):")
+    for h, songs, postings in report["top"]:
+        f1, f2, dt = unpack_hash(h)
+        print(f"  {h:>10}  ({f1:>4}, {f2:>4}, {dt:>3})  in {songs} songs, {postings} postings")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hash popularity statistics and the stop-hash policy")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reporting = sub.add_parser("report", help="Show how the postings are spread over the hashes")
+    reporting.add_argument("--db", default=DB_FILE)
+    reporting.add_argument("--top", type=int, default=10, help="Most common hashes to list")
+    policy = sub.add_parser("policy", help="Show or change the stop-hash policy")
+    policy.add_argument("--db", default=DB_FILE)
+    policy.add_argument("--max-song-fraction", type=float, help="Share of the songs a hash may occur in")
+    policy.add_argument("--min-songs", type=int, help="Lower bound of the threshold, in songs")
+    policy.add_argument("--query", choices=("exclude", "keep"), help="Leave stop hashes out of lookups")
+    policy.add_argument("--index", choices=("cap", "keep"), help="Stop storing postings of stop hashes at ingest (they are then never looked up again)")
+    rebuild = sub.add_parser("rebuild", help="Recount the statistics from the stored fingerprints")
+    rebuild.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Database '{args.db}' does not exist!")
+    else:
+        conn = sqlite3.connect(args.db)
+        create_tables_and_indices(conn)
+        if args.command == "report":
+            print_report(hash_report(conn, args.top))
+        elif args.command == "policy":
+            changes = {"max_song_fraction": args.max_song_fraction, "min_songs": args.min_songs,
+                       "query": args.query, "index": args.index}
+            if any(v is not None for v in changes.values()):
+                current = set_stop_hash_policy(conn, **changes)
+            else:
+                current = get_stop_hash_policy(conn)
+            print(f"Stop-hash policy: {current} (threshold: {stop_hash_threshold(conn, current)} songs)")
+        elif args.command == "rebuild":
+            rebuild_hash_stats(conn)
+            print(f"Counted {conn.execute('SELECT COUNT(*) FROM hash_stats').fetchone()[0]:,} distinct hashes.")
+        conn.close()
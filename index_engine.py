@@ -0,0 +1,382 @@
+# index_engine.py
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.request import pathname2url
+import numpy as np
+from db_utils import (MAX_SHARDS, attach_shards, check_schema_version, fingerprint_tables, get_analysis_profile,
+                      get_db_uuid, get_generation, get_shard_count, shard_of, shard_paths, stop_hashes)
+
+# Fingerprint lookup backends used by recognize().
+#   "sqlite": query the fingerprints table with batched WHERE hash IN (...)
+#   "mmap":   sorted NumPy arrays exported once and memory-mapped at query time
+ENGINES = ("sqlite", "mmap")
+INDEX_DIR = "fingerprint_index"
+MANIFEST = "manifest.json"
+
+def _empty_postings():
+    return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+# === Shared read-only SQLite connections ===
+# Tuned for lookups: read-only, 256 MB memory-mapped I/O, 64 MB page cache.
+# With the database in WAL mode (set in create_tables_and_indices) readers never
+# block on a running ingest and keep their page cache between recognitions.
+READ_PRAGMAS = (
+    "PRAGMA query_only = 1",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+)
+MAX_IDLE_CONNECTIONS = 8
+
+_read_pools = {}
+_read_pools_lock = threading.Lock()
+
+def _open_read_connection(db_file):
+    uri = "file:" + pathname2url(os.path.abspath(db_file)) + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    for pragma in READ_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def acquire_read_connection(db_file):
+    key = os.path.abspath(db_file)
+    with _read_pools_lock:
+        pool = _read_pools.setdefault(key, queue.LifoQueue())
+    try:
+        return pool.get_nowait()
+    except queue.Empty:
+        return _open_read_connection(db_file)
+
+def release_read_connection(db_file, conn):
+    pool = _read_pools.get(os.path.abspath(db_file))
+    if pool is not None and pool.qsize() < MAX_IDLE_CONNECTIONS:
+        pool.put(conn)
+    else:
+        conn.close()
+
+# Fixed batch sizes keep the SQL text identical between calls, so sqlite3's
+# statement cache reuses the prepared statements; short batches are padded
+# with -1, which is never a valid hash.
+BATCH_SIZES = (50, 200, 900)  # 900 stays below SQLite's limit of ? placeholders
+
+SONG_BATCH_SIZE = 50  # with 900 hashes still below the limit
+
+@lru_cache(maxsize=None)
+def _lookup_sql(size, table="fingerprints", columns="hash, song_id, offset", song_batch=0):
+    placeholders = ",".join("?" for _ in range(size))
+    sql = f"SELECT {columns} FROM {table} WHERE hash IN ({placeholders})"
+    if song_batch:
+        # The (hash, song_id, offset) primary key seeks every (hash, song) pair directly
+        sql += " AND song_id IN (" + ",".join("?" for _ in range(song_batch)) + ")"
+    return sql
+
+def _lookup_rows(conn, hashes, table="fingerprints", columns="hash, song_id, offset", song_ids=None):
+    # hashes: list of unique Python ints; song_ids: optional list of Python ints to restrict the rows to
+    c = conn.cursor()
+    rows = []
+    song_batches = [[]]
+    if song_ids is not None:
+        song_batches = [song_ids[j:j+SONG_BATCH_SIZE] for j in range(0, len(song_ids), SONG_BATCH_SIZE)]
+        song_batches = [batch + [-1] * (SONG_BATCH_SIZE - len(batch)) for batch in song_batches]
+    for song_batch in song_batches:
+        i = 0
+        while i < len(hashes):
+            remaining = len(hashes) - i
+            size = next((b for b in BATCH_SIZES if b >= remaining), BATCH_SIZES[-1])
+            batch_hashes = hashes[i:i+size]
+            batch_hashes += [-1] * (size - len(batch_hashes))
+            c.execute(_lookup_sql(size, table, columns, len(song_batch)), batch_hashes + song_batch)
+            rows.extend(c.fetchall())
+            i += size
+    return rows
+
+def _song_list(song_ids):
+    return None if song_ids is None else np.unique(np.asarray(song_ids, dtype=np.int64)).tolist()
+
+def _rows_to_postings(rows):
+    if not rows:
+        return _empty_postings()
+    db_hashes, song_ids, offsets = zip(*rows)
+    return (np.array(db_hashes, dtype=np.uint32),
+            np.array(song_ids, dtype=np.int32),
+            np.array(offsets, dtype=np.int32))
+
+def lookup_postings(conn, hashes):
+    """
+    Postings of hashes on a writer connection (see db_utils.create_tables_and_indices):
+    every fingerprint table it has attached, including rows it has not committed yet.
+    """
+    hashes = np.unique(np.asarray(hashes, dtype=np.int64)).tolist()
+    rows = []
+    for table in fingerprint_tables(conn):
+        rows.extend(_lookup_rows(conn, hashes, table))
+    return _rows_to_postings(rows)
+
+# Stop hashes per database, recomputed when the generation changes (songs added, policy changed)
+_stop_hashes = {}
+_stop_hashes_lock = threading.Lock()
+
+class SQLiteIndex:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = acquire_read_connection(db_file)
+        try:
+            check_schema_version(self.conn)
+        except RuntimeError:
+            release_read_connection(db_file, self.conn)
+            raise
+
+    def lookup(self, hashes, song_ids=None):
+        """
+        Return all postings for the given hashes as three parallel arrays:
+        (hashes, song_ids, offsets); only those of song_ids when given.
+        """
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64)).tolist()
+        return _rows_to_postings(_lookup_rows(self.conn, hashes, song_ids=_song_list(song_ids)))
+
+    def posting_counts(self, hashes):
+        """
+        Number of stored postings of every hash (an array parallel to hashes),
+        from hash_stats; None for a database without the statistics.
+        """
+        hashes = np.asarray(hashes, dtype=np.int64).tolist()
+        try:
+            counts = dict(_lookup_rows(self.conn, hashes, "main.hash_stats", "hash, postings"))
+        except sqlite3.OperationalError:
+            return None
+        return np.array([counts.get(h, 0) for h in hashes], dtype=np.int64)
+
+    def generation(self):
+        # Changes whenever songs are added, see db_utils.bump_generation
+        return get_generation(self.conn)
+
+    def analysis_profile(self):
+        # Queries must be fingerprinted with the (name, params) the songs were indexed with
+        return get_analysis_profile(self.conn)
+
+    def db_uuid(self):
+        # Identity of the database file, None for one that was never opened for writing since
+        return get_db_uuid(self.conn)
+
+    def stop_hashes(self):
+        # Sorted hashes queries leave out (db_utils.stop_hashes)
+        key = os.path.abspath(self.db_file)
+        generation = self.generation()
+        with _stop_hashes_lock:
+            cached = _stop_hashes.get(key)
+            if cached is None or cached[0] != generation:
+                cached = _stop_hashes[key] = (generation, stop_hashes(self.conn))
+            return cached[1]
+
+    def song_filename(self, song_id):
+        row = self.conn.execute("SELECT filename FROM songs WHERE id=?", (int(song_id),)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        # Hand the connection back to the pool instead of closing it
+        if self.conn is not None:
+            release_read_connection(self.db_file, self.conn)
+            self.conn = None
+
+# One thread per shard at most; sqlite3 releases the GIL while a query runs
+_shard_executor = None
+_shard_executor_lock = threading.Lock()
+
+def _get_shard_executor():
+    global _shard_executor
+    with _shard_executor_lock:
+        if _shard_executor is None:
+            _shard_executor = ThreadPoolExecutor(max_workers=MAX_SHARDS, thread_name_prefix="shard-lookup")
+        return _shard_executor
+
+def _lookup_shard(shard_file, hashes, song_ids=None):
+    conn = acquire_read_connection(shard_file)
+    try:
+        return _lookup_rows(conn, hashes, song_ids=song_ids)
+    finally:
+        release_read_connection(shard_file, conn)
+
+class ShardedSQLiteIndex(SQLiteIndex):
+    # Songs are read from the main file, fingerprints from the shard files
+    # (see db_utils.reshard); every shard is queried in parallel.
+    def __init__(self, db_file, shard_count):
+        super().__init__(db_file)
+        self.shard_count = shard_count
+        self.shard_files = shard_paths(db_file, shard_count)
+
+    def lookup(self, hashes, song_ids=None):
+        hashes = np.unique(np.asarray(hashes, dtype=np.int64))
+        shards = shard_of(hashes, self.shard_count)
+        jobs = [(path, hashes[shards == i].tolist()) for i, path in enumerate(self.shard_files)]
+        song_ids = _song_list(song_ids)
+        executor = _get_shard_executor()
+        futures = [executor.submit(_lookup_shard, path, part, song_ids) for path, part in jobs if part]
+        rows = []
+        for future in futures:
+            rows.extend(future.result())
+        return _rows_to_postings(rows)
+
+class MmapIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        manifest_path = os.path.join(index_dir, MANIFEST)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(
+                f"No exported index in '{index_dir}', run 'python index_engine.py export' first")
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.songs = {int(k): v for k, v in manifest["songs"].items()}
+        self.db_generation = manifest.get("generation", 0)
+        self.profile = manifest.get("analysis_profile")
+        self.source_uuid = manifest.get("db_uuid")
+        # mmap_mode="r" maps the files read-only: every process on the host shares
+        # the same page-cache pages instead of holding its own copy
+        self.hashes = np.load(os.path.join(index_dir, "hashes.npy"), mmap_mode="r")
+        self.song_ids = np.load(os.path.join(index_dir, "song_ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"), mmap_mode="r")
+        stop_path = os.path.join(index_dir, "stop_hashes.npy")
+        self.stop = np.load(stop_path) if os.path.exists(stop_path) else np.empty(0, dtype=np.int64)
+
+    def lookup(self, hashes, song_ids=None):
+        query = np.unique(np.asarray(hashes, dtype=np.uint32))
+        # One vectorized binary search for the start and end of every posting list
+        start = np.searchsorted(self.hashes, query, side="left")
+        end = np.searchsorted(self.hashes, query, side="right")
+        counts = end - start
+        total = int(counts.sum())
+        if total == 0:
+            return _empty_postings()
+        # Expand [start, end) ranges into one flat index array
+        first = np.cumsum(counts) - counts
+        idx = np.repeat(start - first, counts) + np.arange(total)
+        if song_ids is not None:
+            # Only the song ids of the other postings are read
+            idx = idx[np.isin(self.song_ids[idx], np.asarray(song_ids, dtype=np.int32))]
+        return self.hashes[idx], self.song_ids[idx], self.offsets[idx]
+
+    def posting_counts(self, hashes):
+        # Length of every posting list, straight from the binary search
+        query = np.asarray(hashes, dtype=np.uint32)
+        return (np.searchsorted(self.hashes, query, side="right")
+                - np.searchsorted(self.hashes, query, side="left")).astype(np.int64)
+
+    def generation(self):
+        # Generation of the database at export time
+        return self.db_generation
+
+    def analysis_profile(self):
+        if self.profile is None:
+            # Exported before profiles were recorded, those indexes all used the default one
+            from fingerprinting import DEFAULT_PROFILE, get_profile
+            return DEFAULT_PROFILE, get_profile(DEFAULT_PROFILE)
+        return self.profile["name"], self.profile["params"]
+
+    def stop_hashes(self):
+        # Stop hashes of the database at export time
+        return self.stop
+
+    def db_uuid(self):
+        # Identity of the exported database
+        return self.source_uuid
+
+    def song_filename(self, song_id):
+        return self.songs.get(int(song_id))
+
+    def close(self):
+        # Mapped indexes are shared per process, see open_index()
+        pass
+
+_mmap_indexes = {}
+_mmap_lock = threading.Lock()
+
+def open_index(engine="sqlite", db_file="music_fingerprints.db", index_dir=INDEX_DIR):
+    if engine == "sqlite":
+        index = SQLiteIndex(db_file)
+        shard_count = get_shard_count(index.conn)
+        if shard_count > 1:
+            index.close()
+            return ShardedSQLiteIndex(db_file, shard_count)
+        return index
+    if engine == "mmap":
+        key = os.path.abspath(index_dir)
+        manifest_path = os.path.join(index_dir, MANIFEST)
+        version = os.path.getmtime(manifest_path) if os.path.exists(manifest_path) else None
+        with _mmap_lock:
+            # Reopen only when the index was exported again
+            cached = _mmap_indexes.get(key)
+            if cached is None or cached[0] != version:
+                _mmap_indexes[key] = (version, MmapIndex(index_dir))
+            return _mmap_indexes[key][1]
+    raise ValueError(f"Unknown index engine: {engine!r} (expected one of {ENGINES})")
+
+def export_index(db_file="music_fingerprints.db", index_dir=INDEX_DIR, batch_size=500000):
+    """
+    Export the fingerprints table into hash-sorted .npy arrays for the mmap engine.
+    Files are written next to the old ones and swapped in at the end.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    attach_shards(conn)
+    c = conn.cursor()
+    tables = fingerprint_tables(conn)
+    total = sum(c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables)
+    songs = dict(c.execute("SELECT id, filename FROM songs").fetchall())
+    generation = get_generation(conn)
+    db_uuid = get_db_uuid(conn)
+    profile_name, profile_params = get_analysis_profile(conn)
+    stop = stop_hashes(conn)
+
+    paths = {name: os.path.join(index_dir, f"{name}.npy") for name in ("hashes", "song_ids", "offsets")}
+    tmp = {name: path + ".tmp" for name, path in paths.items()}
+    arrays = {
+        "hashes": np.lib.format.open_memmap(tmp["hashes"], mode="w+", dtype=np.uint32, shape=(total,)),
+        "song_ids": np.lib.format.open_memmap(tmp["song_ids"], mode="w+", dtype=np.int32, shape=(total,)),
+        "offsets": np.lib.format.open_memmap(tmp["offsets"], mode="w+", dtype=np.int32, shape=(total,)),
+    }
+    # The clustered primary keys already return the rows sorted by hash; for a
+    # sharded database SQLite merges the sorted shards on the fly
+    union = " UNION ALL ".join(f"SELECT hash, song_id, offset FROM {table}" for table in tables)
+    c.execute(f"{union} ORDER BY hash, song_id, offset")
+    pos = 0
+    while True:
+        rows = c.fetchmany(batch_size)
+        if not rows:
+            break
+        block = np.array(rows, dtype=np.int64)
+        n = len(block)
+        arrays["hashes"][pos:pos+n] = block[:, 0]
+        arrays["song_ids"][pos:pos+n] = block[:, 1]
+        arrays["offsets"][pos:pos+n] = block[:, 2]
+        pos += n
+    conn.close()
+    for arr in arrays.values():
+        arr.flush()
+    arrays.clear()
+    for name in paths:
+        os.replace(tmp[name], paths[name])
+    np.save(os.path.join(index_dir, "stop_hashes.npy"), stop)
+    with open(os.path.join(index_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"fingerprints": total, "songs": songs, "generation": generation, "db_uuid": db_uuid,
+                   "analysis_profile": {"name": profile_name, "params": profile_params}}, f)
+    return total
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory-mapped fingerprint index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export the SQLite fingerprints into .npy arrays")
+    export.add_argument("--db", default="music_fingerprints.db")
+    export.add_argument("--out", default=INDEX_DIR)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if not os.path.exists(args.db):
+            print(f"Database '{args.db}' does not exist!")
+        else:
+            total = export_index(args.db, args.out)
+            print(f"Exported {total} fingerprints to '{args.out}'.")
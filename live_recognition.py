@@ -0,0 +1,110 @@
+# live_recognition.py
+
+import queue
+import time
+import numpy as np
+
+from fingerprinting import StreamingFingerprinter
+from index_engine import open_index, INDEX_DIR
+from matching import drop_stop_hashes, join_postings, two_stage_bins, build_result, is_confident
+
+# Stop as soon as the leading song has at least LIVE_MIN_COUNT aligned hashes
+# and LIVE_MARGIN times as many as the best other song.
+LIVE_MIN_COUNT = 8
+LIVE_MARGIN = 2.0
+LIVE_BLOCK_SECONDS = 0.25
+
+class LiveRecognizer:
+    """
+    Incremental recognizer: every block of samples is fingerprinted with a
+    StreamingFingerprinter, its hashes are looked up right away and the offset
+    histogram is updated, so a decision can be made while audio still arrives.
+    """
+
+    def __init__(self, index, sr, margin=LIVE_MARGIN, min_count=LIVE_MIN_COUNT, top_k=5):
+        self.index = index
+        # Same analysis profile as the indexed songs
+        self.fingerprinter = StreamingFingerprinter.from_profile(sr, index.analysis_profile()[1])
+        self.stop_hashes = index.stop_hashes()
+        self.margin = margin
+        self.min_count = min_count
+        self.top_k = top_k
+        self.song_ids = []
+        self.deltas = []
+        self.n_fingerprints = 0
+        self.best_bins = []
+
+    def feed(self, block):
+        # Returns True once the leader is far enough ahead of the runner-up
+        self._add(*self.fingerprinter.feed(block))
+        return self.decided()
+
+    def finish(self):
+        # No more audio: hash the frames still held back by the fingerprinter
+        self._add(*self.fingerprinter.flush())
+        return self.decided()
+
+    def _add(self, hashes, offsets):
+        if len(hashes) == 0:
+            return
+        hashes, offsets, _ = drop_stop_hashes(hashes, offsets, self.stop_hashes)
+        if len(hashes) == 0:
+            return
+        self.n_fingerprints += len(hashes)
+        db_hashes, song_ids, db_offsets = self.index.lookup(hashes)
+        song_ids, deltas = join_postings(hashes, offsets, db_hashes, song_ids, db_offsets)
+        if len(song_ids):
+            self.song_ids.append(song_ids)
+            self.deltas.append(deltas)
+            self.best_bins = two_stage_bins(np.concatenate(self.song_ids), np.concatenate(self.deltas), self.top_k)
+
+    def decided(self):
+        return is_confident(self.best_bins, self.margin, self.min_count)
+
+    def result(self):
+        return build_result(self.best_bins, self.index.song_filename, self.n_fingerprints)
+
+def recognize_live(db_file="music_fingerprints.db", engine="sqlite", index_dir=INDEX_DIR, max_seconds=15,
+                   sr=44100, margin=LIVE_MARGIN, min_count=LIVE_MIN_COUNT, on_update=None):
+    """
+    Listen on the default microphone and recognize while recording.
+    Stops early once the leading candidate passes the margin over the runner-up,
+    otherwise after max_seconds. on_update(elapsed, result) is called after every block.
+    Returns (result, recorded_audio, elapsed_seconds).
+    """
+    import sounddevice as sd
+
+    index = open_index(engine, db_file, index_dir)
+    recognizer = LiveRecognizer(index, sr, margin=margin, min_count=min_count)
+    blocks = queue.Queue()
+    recorded = []
+
+    def callback(indata, frames, time_info, status):
+        # Runs on the audio thread: only copy the samples, all work happens below
+        blocks.put(indata[:, 0].copy())
+
+    start = time.perf_counter()
+    try:
+        with sd.InputStream(samplerate=sr, channels=1, dtype="float32",
+                            blocksize=int(LIVE_BLOCK_SECONDS * sr), callback=callback):
+            while True:
+                elapsed = time.perf_counter() - start
+                if elapsed >= max_seconds:
+                    break
+                try:
+                    block = blocks.get(timeout=max(0.01, min(1.0, max_seconds - elapsed)))
+                except queue.Empty:
+                    continue
+                recorded.append(block)
+                done = recognizer.feed(block)
+                if on_update:
+                    on_update(time.perf_counter() - start, recognizer.result())
+                if done:
+                    break
+        if not recognizer.decided():
+            recognizer.finish()
+        result = recognizer.result()
+    finally:
+        index.close()
+    audio = np.concatenate(recorded) if recorded else np.empty(0, dtype=np.float32)
+    return result, audio, time.perf_counter() - start
@@ -0,0 +1,150 @@
+# matching.py
+
+import numpy as np
+
+# Offset-histogram scoring: a true match shows many hashes at the same
+# time difference (delta = song offset - query offset) within one song.
+
+# Two-stage scoring: stage 1 counts hash hits per song in coarse delta buckets
+# to pick TWO_STAGE_CANDIDATES songs, stage 2 builds exact offset histograms for
+# those songs only (see recognition.match_fingerprints for the fetches).
+TWO_STAGE_CANDIDATES = 20
+COARSE_DELTA_BITS = 4           # stage-1 buckets of 16 frames
+COARSE_SLOTS_PER_PAIR = 8       # stage-1 hit counters per pair, at least COARSE_MIN_SLOTS
+COARSE_MIN_SLOTS = 1 << 16
+
+def join_postings(query_hashes, query_offsets, db_hashes, song_ids, db_offsets):
+    """
+    Join the postings returned by the index with the query fingerprints.
+    Returns two parallel arrays (song_ids, deltas), one entry per (posting, query time) pair.
+    """
+    query_hashes = np.asarray(query_hashes, dtype=np.int64)
+    db_hashes = np.asarray(db_hashes, dtype=np.int64)
+    order = np.argsort(query_hashes, kind="stable")
+    q_hashes = query_hashes[order]
+    q_offsets = np.asarray(query_offsets, dtype=np.int64)[order]
+
+    # Every posting matches the run of equal hashes in the sorted query
+    start = np.searchsorted(q_hashes, db_hashes, side="left")
+    end = np.searchsorted(q_hashes, db_hashes, side="right")
+    counts = end - start
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(db_hashes)), counts)
+    first = np.cumsum(counts) - counts
+    q_idx = np.repeat(start - first, counts) + np.arange(total)
+
+    song_ids = np.asarray(song_ids, dtype=np.int64)[rows]
+    deltas = np.asarray(db_offsets, dtype=np.int64)[rows] - q_offsets[q_idx]
+    return song_ids, deltas
+
+def drop_stop_hashes(query_hashes, query_offsets, stop_hashes):
+    """
+    Leave out query fingerprints whose hash is a stop hash (sorted array, see
+    db_utils.stop_hashes): they would fetch postings of many songs but rarely
+    fall into the winning offset bin. Returns (hashes, offsets, n_dropped).
+    """
+    query_hashes = np.asarray(query_hashes, dtype=np.int64)
+    query_offsets = np.asarray(query_offsets, dtype=np.int64)
+    if len(stop_hashes) == 0 or len(query_hashes) == 0:
+        return query_hashes, query_offsets, 0
+    keep = ~np.isin(query_hashes, stop_hashes)
+    return query_hashes[keep], query_offsets[keep], int(len(keep) - keep.sum())
+
+def top_bins(song_ids, deltas, top_k=5, counters=None):
+    """
+    Count (song_id, delta) bins and return the best bin of the top_k songs as a
+    list of (song_id, delta, count) tuples, best first.
+    """
+    if len(song_ids) == 0:
+        if counters is not None:
+            counters["candidate_bins"] = 0
+        return []
+    # Pack (song_id, delta) into one int64 key: song_id in the high half, shifted delta in the low half
+    keys = (song_ids << 32) | (deltas + (1 << 31))
+    bins, counts = np.unique(keys, return_counts=True)
+    if counters is not None:
+        counters["candidate_bins"] = len(bins)
+    bin_songs = bins >> 32
+
+    # Keep only the strongest delta of every song (bins are sorted by song already)
+    order = np.lexsort((-counts, bin_songs))
+    _, first = np.unique(bin_songs[order], return_index=True)
+    best_per_song = order[first]
+
+    k = min(top_k, len(best_per_song))
+    counts_per_song = counts[best_per_song]
+    best = best_per_song[np.argpartition(counts_per_song, len(counts_per_song) - k)[len(counts_per_song) - k:]]
+    best = best[np.lexsort((bins[best], -counts[best]))]
+    return [
+        (int(bin_songs[i]), int((bins[i] & 0xFFFFFFFF) - (1 << 31)), int(counts[i]))
+        for i in best
+    ]
+
+def is_confident(best_bins, margin=2.0, min_count=8):
+    # The leading song has min_count aligned hashes and margin times as many as the runner-up
+    if not best_bins:
+        return False
+    leader = best_bins[0][2]
+    runner_up = best_bins[1][2] if len(best_bins) > 1 else 0
+    return leader >= min_count and leader >= margin * max(runner_up, 1)
+
+def candidate_songs(song_ids, deltas, n=TWO_STAGE_CANDIDATES):
+    """
+    Stage 1: ids of the n songs with the most hits in one coarse delta bucket,
+    sorted. Hits are counted in a hashed table with COARSE_SLOTS_PER_PAIR
+    counters per pair; a collision of two (song, bucket) pairs adds hits to both.
+    """
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    if len(song_ids) == 0:
+        return np.empty(0, dtype=np.int64)
+    buckets = np.asarray(deltas, dtype=np.int64) >> COARSE_DELTA_BITS
+    table_size = 1 << int(max(COARSE_SLOTS_PER_PAIR * len(song_ids), COARSE_MIN_SLOTS) - 1).bit_length()
+    slots = (song_ids * 1000003 + buckets) & (table_size - 1)
+    hits = np.bincount(slots, minlength=table_size)[slots]
+    songs, song_idx = np.unique(song_ids, return_inverse=True)
+    best = np.zeros(len(songs), dtype=np.int64)
+    np.maximum.at(best, song_idx, hits)
+    if len(songs) > n:
+        songs = np.sort(songs[np.argpartition(best, len(songs) - n)[len(songs) - n:]])
+    return songs
+
+def two_stage_bins(song_ids, deltas, top_k=5, counters=None, candidates=TWO_STAGE_CANDIDATES):
+    """
+    Stage 2: top_bins() over the matched pairs of the candidate_songs() only.
+    The aligned hashes of the true song fall into one or two coarse buckets, so
+    it is among the candidates; candidates=None scores every song.
+    """
+    if candidates:
+        songs = candidate_songs(song_ids, deltas, candidates)
+        if counters is not None:
+            counters["candidate_songs"] = len(songs)
+        keep = np.isin(song_ids, songs)
+        song_ids, deltas = song_ids[keep], deltas[keep]
+    return top_bins(song_ids, deltas, top_k, counters)
+
+def score_matches(query_hashes, query_offsets, db_hashes, song_ids, db_offsets, top_k=5, counters=None,
+                  candidates=TWO_STAGE_CANDIDATES):
+    song_ids, deltas = join_postings(query_hashes, query_offsets, db_hashes, song_ids, db_offsets)
+    if counters is not None:
+        counters["matched_pairs"] = len(song_ids)
+    return two_stage_bins(song_ids, deltas, top_k, counters, candidates)
+
+def no_match_result():
+    return {"song": None, "count": None, "delta": None, "confidence": None, "candidates": []}
+
+def build_result(best_bins, song_filename, n_fingerprints=None):
+    # Turn (song_id, delta, count) bins into the result dict returned by recognize().
+    # "confidence" is the share of the n_fingerprints query fingerprints (without
+    # stop hashes) that line up in the song, 0..1 whatever the clip length.
+    candidates = [
+        {"song": song_filename(song_id), "song_id": song_id, "count": count, "delta": delta,
+         "confidence": min(count / n_fingerprints, 1.0) if n_fingerprints else None}
+        for song_id, delta, count in best_bins
+    ]
+    if not candidates or not candidates[0]["song"]:
+        return no_match_result()
+    best = candidates[0]
+    return {"song": best["song"], "count": best["count"], "delta": best["delta"],
+            "confidence": best["confidence"], "candidates": candidates}
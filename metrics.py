@@ -0,0 +1,82 @@
+# metrics.py
+# Per-stage timings and counters for recognitions, plus pluggable sinks for them.
+
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+class StageTimer:
+    """Collects wall-clock milliseconds per named stage: with timer.stage("lookup"): ..."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - t0) * 1000
+
+def stage(timer, name):
+    # Lets instrumented functions accept timer=None at no cost
+    return timer.stage(name) if timer is not None else nullcontext()
+
+# === Sinks ===
+_hooks = []
+_hooks_lock = threading.Lock()
+
+def add_metrics_hook(hook):
+    """Register hook(record) to be called with the metrics dict of every recognition."""
+    with _hooks_lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+    return hook
+
+def emit_metrics(record):
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        # A broken metrics sink must never break a recognition
+        try:
+            hook(record)
+        except Exception as e:
+            print(f"[metrics] hook {hook!r} failed: {e}")
+
+class JsonLinesHook:
+    """Appends every record as one JSON line to path."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def __eq__(self, other):
+        return isinstance(other, JsonLinesHook) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+def enable_json_log(path):
+    return add_metrics_hook(JsonLinesHook(path))
+
+# === Profiling ===
+def profile_call(func, *args, limit=25, **kwargs):
+    """Run func under cProfile; returns (func result, text report of the top functions)."""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+    return result, out.getvalue()
+
+def format_timings(timings):
+    return " | ".join(f"{name} {ms:.1f} ms" for name, ms in timings.items())
@@ -0,0 +1,277 @@
+# recognition.py
+# Query side of the pipeline, shared by the Streamlit app and the batch CLI.
+
+import os
+import time
+import librosa
+import numpy as np
+
+from fingerprinting import (preprocess_audio, get_peaks, generate_fingerprints, get_profile, peak_params,
+                            pair_params, audio_duration, fingerprint_file_streaming, STREAMING_MIN_SECONDS)
+from index_engine import open_index, INDEX_DIR
+from matching import (drop_stop_hashes, score_matches, join_postings, candidate_songs, top_bins, two_stage_bins,
+                      is_confident, build_result, no_match_result)
+from metrics import StageTimer, stage, emit_metrics, profile_call, format_timings
+from result_cache import get_result_cache, audio_digest, cache_key
+
+DB_FILE = "music_fingerprints.db"
+INDEX_ENGINE = "sqlite"  # "sqlite" or "mmap" (run 'python index_engine.py export' first)
+
+# Progressive mode: hashes are looked up in rounds of PROGRESSIVE_FIRST_ROUND,
+# 2x, 4x, ... hashes, the rarest first, until the best song is PROGRESSIVE_MARGIN
+# times ahead of the runner-up with at least PROGRESSIVE_MIN_COUNT aligned hashes
+PROGRESSIVE_FIRST_ROUND = 64
+PROGRESSIVE_MARGIN = 2.0
+PROGRESSIVE_MIN_COUNT = 8
+
+# Two-stage lookup: the rarest hashes, up to STAGE_ONE_POSTINGS postings, pick the
+# candidate songs; the other hashes are fetched for those songs only, so the rows
+# per query stay bounded however many songs share the common hashes
+STAGE_ONE_POSTINGS = 5000
+
+def decode_query(query_path, timer=None):
+    # Long recordings are not decoded up front, fingerprint_query() streams them block by block
+    duration = audio_duration(query_path)
+    if duration and duration > STREAMING_MIN_SECONDS:
+        return None
+
+    # Load the audio file that we want to recognize.
+    # y = the audio data (like a long list of sound numbers), sr = sample rate (how many samples per second)
+    with stage(timer, "decode"):
+        return librosa.load(query_path, sr=None, mono=True)
+
+def fingerprint_query(query_path, timer=None, counters=None, audio=None, params=None):
+    # audio: (y, sr) from decode_query() when the caller already decoded the file
+    # params: analysis profile of the index (index.analysis_profile()), default profile if None
+    params = params or get_profile()
+    if audio is None:
+        audio = decode_query(query_path, timer)
+    if audio is None:
+        # Long recordings are fingerprinted block by block, so memory stays flat
+        with stage(timer, "streaming_fingerprint"):
+            n_peaks, hashes, offsets = fingerprint_file_streaming(query_path, params=params)
+        if counters is not None:
+            counters["peaks"] = n_peaks
+        return hashes, offsets
+    y, sr = audio
+    
+    # Preprocess the audio to make it easier to analyze (resample, clean up, normalize, etc.)
+    with stage(timer, "preprocess"):
+        y, sr = preprocess_audio(y, sr, target_sr=params["sr"])
+    
+    # Find the most important frequency peaks in the audio. Peaks are like unique "sound events" in a song.
+    peaks = get_peaks(y, sr, timer=timer, **peak_params(params))
+    
+    # Convert those peaks into fingerprints (unique codes that represent moments in the song).
+    # Each fingerprint is a packed integer hash plus the frame where it starts.
+    with stage(timer, "hashing"):
+        hashes, offsets = generate_fingerprints(peaks, **pair_params(params))
+    if counters is not None:
+        counters["peaks"] = len(peaks)
+    return hashes, offsets
+
+def _query_hashes(index, query_hashes, query_offsets, counters=None):
+    if counters is not None:
+        counters["fingerprints"] = len(query_hashes)
+        counters["unique_hashes"] = len(np.unique(query_hashes))
+    # Skip hashes that occur in too many songs to tell them apart (see hash_stats.py)
+    query_hashes, query_offsets, n_stop = drop_stop_hashes(query_hashes, query_offsets, index.stop_hashes())
+    if counters is not None:
+        counters["stop_hashes"] = n_stop
+    return query_hashes, query_offsets
+
+def match_fingerprints(index, query_hashes, query_offsets, top_k=5, timer=None, counters=None):
+    query_hashes, query_offsets = _query_hashes(index, query_hashes, query_offsets, counters)
+    # If no fingerprints could be created (maybe the audio is empty or too noisy), return nothing.
+    if len(query_hashes) == 0:
+        return no_match_result()
+
+    # How many songs contain each hash decides which hashes stage 1 fetches
+    unique = np.unique(query_hashes)
+    with stage(timer, "selectivity"):
+        postings = index.posting_counts(unique)
+    if postings is None:
+        return _match_all(index, query_hashes, query_offsets, top_k, timer, counters)
+    order = np.argsort(postings, kind="stable")
+    n_first = max(int(np.searchsorted(np.cumsum(postings[order]), STAGE_ONE_POSTINGS, side="right")), 1)
+    first, rest = unique[order[:n_first]], unique[order[n_first:]]
+    rest = rest[postings[order[n_first:]] > 0]
+
+    # Stage 1: find all fingerprints of the rare hashes and pick the songs they line up in
+    with stage(timer, "lookup"):
+        db_hashes, song_ids, db_offsets = index.lookup(first)
+    with stage(timer, "scoring"):
+        song_ids, deltas = join_postings(query_hashes, query_offsets, db_hashes, song_ids, db_offsets)
+        songs = candidate_songs(song_ids, deltas)
+        keep = np.isin(song_ids, songs)
+        song_ids, deltas = song_ids[keep], deltas[keep]
+    n_rows = len(db_hashes)
+
+    # Stage 2: the common hashes, in the candidate songs only
+    if len(rest) and len(songs):
+        with stage(timer, "lookup"):
+            db_hashes, rest_song_ids, db_offsets = index.lookup(rest, song_ids=songs)
+        with stage(timer, "scoring"):
+            rest_song_ids, rest_deltas = join_postings(query_hashes, query_offsets,
+                                                       db_hashes, rest_song_ids, db_offsets)
+            song_ids, deltas = np.concatenate([song_ids, rest_song_ids]), np.concatenate([deltas, rest_deltas])
+        n_rows += len(db_hashes)
+    if counters is not None:
+        counters.update(db_rows=n_rows, stage_one_hashes=len(first), candidate_songs=len(songs),
+                        matched_pairs=len(song_ids))
+
+    # Count how often each (song, offset) pairing occurs. If many hashes line up at
+    # the same time "difference" (offset) in one song, it's a strong match!
+    with stage(timer, "scoring"):
+        best_bins = top_bins(song_ids, deltas, top_k, counters)
+
+        # Get the filenames of the best (song_id, offset) pairings, the first one is the "winner".
+        # If we didn't find any matches (or something went wrong), the result is empty.
+        return build_result(best_bins, index.song_filename, len(query_hashes))
+
+def _match_all(index, query_hashes, query_offsets, top_k=5, timer=None, counters=None):
+    # Without posting counts (no hash_stats table) every posting is fetched in one go
+    with stage(timer, "lookup"):
+        db_hashes, song_ids, db_offsets = index.lookup(query_hashes)
+    if counters is not None:
+        counters["db_rows"] = len(db_hashes)
+    with stage(timer, "scoring"):
+        best_bins = score_matches(query_hashes, query_offsets, db_hashes, song_ids, db_offsets,
+                                  top_k=top_k, counters=counters)
+        return build_result(best_bins, index.song_filename, len(query_hashes))
+
+def match_progressive(index, query_hashes, query_offsets, top_k=5, timer=None, counters=None, deadline=None,
+                      margin=PROGRESSIVE_MARGIN, min_count=PROGRESSIVE_MIN_COUNT, first_round=PROGRESSIVE_FIRST_ROUND):
+    """
+    Same result as match_fingerprints() for a clear winner, from fewer rows: the
+    unique hashes are looked up in growing rounds, those with the fewest postings
+    first, and the scores are updated after every round. Stops once the best
+    song is confident (see matching.is_confident) or when time.perf_counter()
+    passes deadline; rounds are cut short to the postings the time left allows
+    at the cost measured in earlier rounds. counters["rounds"] tells how many
+    rounds were needed.
+    """
+    query_hashes, query_offsets = _query_hashes(index, query_hashes, query_offsets, counters)
+    if len(query_hashes) == 0:
+        return no_match_result()
+
+    # Rare hashes tell songs apart best and fetch few rows; hashes without postings cannot match
+    unique = np.unique(query_hashes)
+    with stage(timer, "selectivity"):
+        postings = index.posting_counts(unique)
+    if postings is not None:
+        order = np.argsort(postings[postings > 0], kind="stable")
+        unique, postings = unique[postings > 0][order], postings[postings > 0][order]
+    n_planned = 0
+    start, size = 0, first_round
+    while start < len(unique):
+        n_planned += 1
+        start, size = start + size, size * 2
+    # Work done after the first n hashes, in postings (or hashes without posting counts)
+    work = np.cumsum(postings if postings is not None else np.ones(len(unique), dtype=np.int64))
+
+    song_ids, deltas, best_bins = [], [], []
+    n_rows = n_pairs = n_rounds = 0
+    budget_hit = False
+    start, size = 0, first_round
+    t_start = time.perf_counter()
+    while start < len(unique):
+        end = min(start + size, len(unique))
+        if deadline is not None and n_rounds:
+            # Cut the round to what the time left allows at the cost measured so far
+            cost = max((time.perf_counter() - t_start) / float(work[start - 1]), 1e-9)
+            affordable = (deadline - time.perf_counter()) / cost
+            end = min(end, int(np.searchsorted(work, work[start - 1] + affordable, side="right")))
+            if end <= start:
+                budget_hit = True
+                break
+        part = unique[start:end]
+        with stage(timer, "lookup"):
+            db_hashes, part_song_ids, db_offsets = index.lookup(part)
+        with stage(timer, "scoring"):
+            in_part = np.isin(query_hashes, part)
+            part_song_ids, part_deltas = join_postings(query_hashes[in_part], query_offsets[in_part],
+                                                       db_hashes, part_song_ids, db_offsets)
+            if len(part_song_ids):
+                song_ids.append(part_song_ids)
+                deltas.append(part_deltas)
+                best_bins = two_stage_bins(np.concatenate(song_ids), np.concatenate(deltas), top_k, counters)
+        n_rows += len(db_hashes)
+        n_pairs += len(part_song_ids)
+        n_rounds += 1
+        if is_confident(best_bins, margin, min_count):
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            budget_hit = end < len(unique)
+            break
+        start, size = end, size * 2
+    if counters is not None:
+        counters.update(db_rows=n_rows, matched_pairs=n_pairs, rounds=n_rounds, rounds_planned=n_planned,
+                        budget_hit=int(budget_hit))
+    with stage(timer, "scoring"):
+        return build_result(best_bins, index.song_filename, len(query_hashes))
+
+def recognize(query_path, db_file=DB_FILE, show_benchmark=False, engine=INDEX_ENGINE, index_dir=INDEX_DIR,
+              top_k=5, profile=False, use_cache=True, progressive=False, budget_ms=None):
+    # Returns a dict with the best "song" (filename), its matching fingerprint "count" and
+    # time "delta" (in frames), plus the top_k "candidates" (best first).
+    # "timings" (ms per stage) and "counters" describe where the time went;
+    # show_benchmark prints them, profile=True adds a cProfile report under "profile".
+    # With use_cache, a clip that was recognized before against the same songs is answered
+    # from the result cache (see result_cache.py) without fingerprinting it again.
+    # progressive looks the hashes up in rounds and stops once the match is clear
+    # (see match_progressive); budget_ms then caps the time of the whole recognition.
+    if profile:
+        # Profile the full pipeline, not a cache hit
+        result, report = profile_call(recognize, query_path, db_file, show_benchmark, engine, index_dir, top_k,
+                                      use_cache=False, progressive=progressive, budget_ms=budget_ms)
+        result["profile"] = report
+        return result
+
+    # Start a timer to see how long the whole process takes
+    t0 = time.perf_counter()
+    timer = StageTimer()
+    counters = {}
+
+    audio = decode_query(query_path, timer)
+    # Open the fingerprint index (SQLite database or memory-mapped arrays)
+    with timer.stage("open_index"):
+        index = open_index(engine, db_file, index_dir)
+    try:
+        # The query is fingerprinted with the same analysis profile as the songs
+        profile_name, params = index.analysis_profile()
+        result = None
+        if use_cache:
+            with timer.stage("cache_lookup"):
+                # A database rebuilt at the same path starts again at the same generations
+                source = f"{engine}:{os.path.abspath(db_file if engine == 'sqlite' else index_dir)}:{index.db_uuid()}"
+                if progressive:
+                    source += ":progressive"
+                key = cache_key(audio_digest(audio, query_path), source, top_k, profile_name)
+                generation = index.generation()
+                result = get_result_cache().get(key, generation)
+            counters["cache_hit"] = int(result is not None)
+        if result is None:
+            query_hashes, query_offsets = fingerprint_query(query_path, timer, counters, audio, params)
+            if len(query_hashes) == 0:
+                # Let the caller (page) display info; just return an empty result
+                result = no_match_result()
+            elif progressive:
+                deadline = t0 + budget_ms / 1000 if budget_ms else None
+                result = match_progressive(index, query_hashes, query_offsets, top_k, timer, counters, deadline)
+            else:
+                result = match_fingerprints(index, query_hashes, query_offsets, top_k, timer, counters)
+            # A result cut short by the budget could be better next time, it is not kept
+            if use_cache and not counters.get("budget_hit"):
+                get_result_cache().put(key, generation, result)
+    finally:
+        index.close()
+    timer.timings["total"] = (time.perf_counter() - t0) * 1000
+
+    result["timings"] = timer.timings
+    result["counters"] = counters
+    emit_metrics({"time": time.time(), "query": query_path, "engine": engine, "song": result["song"],
+                  "count": result["count"], "timings": timer.timings, "counters": counters})
+    if show_benchmark:
+        print(f"[recognize] {query_path} -> {result['song']} | {format_timings(timer.timings)} | {counters}")
+    return result
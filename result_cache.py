@@ -0,0 +1,112 @@
+# result_cache.py
+# Recognition results keyed by the content of the query audio, shared by all
+# sessions of the process. Classroom demos upload the same clip again and again.
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+RESULT_CACHE_SIZE = 256  # results kept, least recently used ones are dropped first
+
+def audio_digest(audio=None, path=None, chunk_size=1 << 20):
+    """
+    SHA-1 of the decoded samples (audio = (y, sr)), so a clip hits the cache under
+    any file name. Long recordings that are streamed, not decoded, are hashed by file bytes.
+    """
+    h = hashlib.sha1()
+    if audio is not None:
+        y, sr = audio
+        h.update(str(int(sr)).encode())
+        h.update(np.ascontiguousarray(y, dtype=np.float32).tobytes())
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+def cache_key(digest, source, top_k, profile="default"):
+    # source names the index (engine + database / index folder) the result came from.
+    # Imported here so the app can configure the cache without loading librosa
+    from fingerprinting import FINGERPRINT_VERSION
+    return f"{digest}:v{FINGERPRINT_VERSION}:{profile}:k{top_k}:{source}"
+
+class ResultCache:
+    """Thread-safe LRU of key -> (generation, result), optionally mirrored to a JSON file."""
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, key, generation):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != generation:
+                # Songs were added since, the stored answer may be wrong now
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key, generation, result):
+        with self.lock:
+            self.entries[key] = (generation, copy.deepcopy(result))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.path:
+                self._save()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[result_cache] ignoring unreadable cache file {self.path}: {e}")
+            return
+        for key, generation, result in data[-self.max_entries:]:
+            self.entries[key] = (generation, result)
+
+    def _save(self):
+        # Write next to the old file and swap, a crash never leaves half a file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([[key, generation, result] for key, (generation, result) in self.entries.items()], f)
+        os.replace(tmp, self.path)
+
+_cache = ResultCache()
+_cache_lock = threading.Lock()
+
+def get_result_cache():
+    return _cache
+
+def configure_result_cache(max_entries=RESULT_CACHE_SIZE, path=None):
+    # Safe to call on every Streamlit rerun: the cache is only replaced when the settings change
+    global _cache
+    with _cache_lock:
+        if _cache.max_entries != max_entries or _cache.path != path:
+            _cache = ResultCache(max_entries, path)
+        return _cache
@@ -0,0 +1,186 @@
+# song_assets.py
+# Pictures for the result page, rendered once per song when it is ingested and
+# stored in the song_assets table, so showing a result never decodes the song again.
+
+import io
+import os
+import sqlite3
+import librosa
+import librosa.display
+import matplotlib.pyplot as plt
+import matplotlib.cm as cm
+import numpy as np
+
+from audio_cache import load_audio, AUDIO_CACHE_DIR, ANALYSIS_SR
+from fingerprinting import preprocess_audio, get_peaks
+from db_utils import create_tables_and_indices, save_song_assets, get_analysis_profile
+from index_engine import acquire_read_connection, release_read_connection
+
+SONG_FOLDER = "music_wavs"
+DB_FILE = "music_fingerprints.db"
+N_FFT = 1024
+HOP_LENGTH = 512
+SR_QUERY = 8000
+FREQ_MIN = 32
+FREQ_MAX = 4096
+ASSET_SECONDS = 15  # the pictures show the start of the song
+
+# === Plotting Helpers ===
+def plot_debug_spectrogram_img_fast(y, sr, title="Spectrogram", progress_callback=None):
+    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    if progress_callback: progress_callback(40)
+    S_db = librosa.amplitude_to_db(S, ref=np.max)
+    if progress_callback: progress_callback(80)
+    fig, ax = plt.subplots(figsize=(8, 3))
+    librosa.display.specshow(S_db, sr=sr, hop_length=HOP_LENGTH, x_axis='time', y_axis='log', cmap='magma', ax=ax)
+    ax.set_title(title)
+    ax.set_ylim(FREQ_MIN, FREQ_MAX)
+    plt.tight_layout()
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png", bbox_inches="tight", dpi=120)
+    plt.close(fig)
+    buf.seek(0)
+    if progress_callback: progress_callback(100)
+    return buf
+
+def plot_spectrogram_peaks_connections_fast(
+        y, sr, peaks, fan_value=10, top_n=360, title="Spectrogram + Peaks + Connections"):
+    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    S_db = librosa.amplitude_to_db(S, ref=np.max)
+    fig, ax = plt.subplots(figsize=(8, 3))
+    librosa.display.specshow(S_db, sr=sr, hop_length=HOP_LENGTH, x_axis='time', y_axis='log', cmap='magma', ax=ax)
+    ax.set_title(title)
+    ax.set_ylim(FREQ_MIN, FREQ_MAX)
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=N_FFT)
+    max_frame = S_db.shape[1]
+    peaks_plot = [p for p in peaks if p[1] < max_frame and p[0] < len(freqs)]
+    # Only top_n most powerful peaks for clarity
+    if len(peaks_plot) > 0:
+        peak_strengths = [S_db[f, t] for f, t in peaks_plot]
+        idx = np.argsort(peak_strengths)[-top_n:]
+        peaks_display = [peaks_plot[i] for i in idx]
+    else:
+        peaks_display = []
+    colors = cm.viridis(np.linspace(0, 1, max(len(peaks_display), 1)))
+    peaks_sorted = sorted(peaks_display, key=lambda x: x[1])
+    for i, (f1, t1) in enumerate(peaks_sorted):
+        color = colors[i]
+        for j in range(1, fan_value):
+            if i + j < len(peaks_sorted):
+                f2, t2 = peaks_sorted[i + j]
+                dt = t2 - t1
+                if 5 < dt <= 120:
+                    freq1 = freqs[f1]
+                    time1 = librosa.frames_to_time([t1], sr=sr, hop_length=HOP_LENGTH, n_fft=N_FFT)[0]
+                    freq2 = freqs[f2]
+                    time2 = librosa.frames_to_time([t2], sr=sr, hop_length=HOP_LENGTH, n_fft=N_FFT)[0]
+                    ax.plot([time1, time2], [freq1, freq2], color=color, alpha=0.22, linewidth=0.7, zorder=1)
+    if peaks_display:
+        times_idx = [p[1] for p in peaks_display]
+        freq_bins = [p[0] for p in peaks_display]
+        times = librosa.frames_to_time(times_idx, sr=sr, hop_length=HOP_LENGTH, n_fft=N_FFT)
+        freqs_plot = freqs[freq_bins]
+        ax.scatter(times, freqs_plot, color='cyan', s=26, zorder=2, edgecolors='black', linewidths=0.5)
+    plt.tight_layout()
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png", bbox_inches="tight", dpi=120)
+    plt.close(fig)
+    buf.seek(0)
+    return buf
+
+def plot_thumbnail(y, sr):
+    # Small spectrogram without axes for the history list
+    S_db = librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)), ref=np.max)
+    fig, ax = plt.subplots(figsize=(2.4, 0.8))
+    librosa.display.specshow(S_db, sr=sr, hop_length=HOP_LENGTH, y_axis='log', cmap='magma', ax=ax)
+    ax.set_ylim(FREQ_MIN, FREQ_MAX)
+    ax.set_axis_off()
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, dpi=80)
+    plt.close(fig)
+    buf.seek(0)
+    return buf
+
+# === Assets ===
+def render_song_assets(path, cache_dir=AUDIO_CACHE_DIR, sr=ANALYSIS_SR):
+    """
+    Render the result-page pictures of one song: kind -> bytes.
+    sr is the sample rate of the analysis profile, so the pictures read the
+    same cached decode as the fingerprints.
+    """
+    y, sr = load_audio(path, sr=sr, duration=ASSET_SECONDS, cache_dir=cache_dir)
+    y, sr = preprocess_audio(y, sr, target_sr=sr)
+    peaks = get_peaks(y, sr)
+    return {
+        "spectrogram": plot_debug_spectrogram_img_fast(y, sr, "Spectrogram of recognized song").getvalue(),
+        "constellation": plot_spectrogram_peaks_connections_fast(
+            y, sr, peaks, fan_value=5, top_n=60, title="Spectrogram + Peaks + Connections").getvalue(),
+        "thumbnail": plot_thumbnail(y, sr).getvalue(),
+    }
+
+def try_render_song_assets(path, cache_dir=AUDIO_CACHE_DIR, sr=ANALYSIS_SR):
+    # Pictures are a nice-to-have: a failure must never stop a song from being indexed
+    try:
+        return render_song_assets(path, cache_dir, sr)
+    except Exception as e:
+        print(f"    ⚠️ Could not render pictures for {os.path.basename(path)}: {e}")
+        return None
+
+def get_song_assets(filename, db_file=DB_FILE):
+    """Stored pictures of a song by filename (an empty dict if there are none yet)."""
+    conn = acquire_read_connection(db_file)
+    try:
+        rows = conn.execute("""
+            SELECT a.kind, a.data FROM song_assets a JOIN songs s ON s.id = a.song_id
+            WHERE s.filename = ?""", (filename,)).fetchall()
+    except sqlite3.OperationalError:
+        # Database from before the song_assets table
+        rows = []
+    finally:
+        release_read_connection(db_file, conn)
+    return {kind: bytes(data) for kind, data in rows}
+
+def backfill_assets(db_file=DB_FILE, song_folder=SONG_FOLDER, force=False):
+    """Render the pictures of songs that were indexed without them (all songs with force)."""
+    conn = sqlite3.connect(db_file)
+    try:
+        create_tables_and_indices(conn)
+        sr = get_analysis_profile(conn)[1]["sr"]
+        if force:
+            songs = conn.execute("SELECT id, filename FROM songs").fetchall()
+        else:
+            songs = conn.execute("""
+                SELECT id, filename FROM songs
+                WHERE id NOT IN (SELECT song_id FROM song_assets WHERE kind = 'spectrogram')""").fetchall()
+        done = 0
+        for idx, (song_id, filename) in enumerate(songs, 1):
+            path = os.path.join(song_folder, filename)
+            print(f"({idx}/{len(songs)}) Rendering: {filename}")
+            if not os.path.exists(path):
+                print(f"    ⚠️ Audio not found in '{song_folder}', skipping.")
+                continue
+            assets = try_render_song_assets(path, sr=sr)
+            if assets:
+                save_song_assets(conn, song_id, assets)
+                done += 1
+    finally:
+        conn.close()
+    return done
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precomputed pictures for the result page")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill", help="Render the pictures of songs that do not have them yet")
+    backfill.add_argument("--db", default=DB_FILE)
+    backfill.add_argument("--songs", default=SONG_FOLDER, help="Folder with the song audio")
+    backfill.add_argument("--force", action="store_true", help="Render all songs again")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        if not os.path.exists(args.db):
+            print(f"Database '{args.db}' does not exist!")
+        else:
+            done = backfill_assets(args.db, args.songs, args.force)
+            print(f"Rendered pictures for {done} song(s).")
@@ -1,22 +1,36 @@
 import csv
 import os
+import sqlite3
+import threading
+
+from db_utils import create_tables_and_indices, get_meta, set_meta, bump_counter
+from index_engine import acquire_read_connection, release_read_connection
 
 SONGS_CSV = "songs_db.csv"
+DB_FILE = "music_fingerprints.db"
+
+# Song metadata (display name, Spotify link, duration, fingerprint count) lives in
+# the songs table of the fingerprint database. Reads go through an in-process
+# cache that is dropped whenever the db_meta counter "songs_version" changes;
+# every write bumps it, in this process or any other.
+_cache = {}  # absolute db path -> (songs_version, {filename: info})
+_cache_lock = threading.Lock()
+_prepared = set()
 
-def load_songs():
+def read_csv(csv_path=SONGS_CSV):
     """
-    Load songs from the CSV as a dict:
+    Load songs from the old CSV as a dict:
     {filename: {"display_name": ..., "spotify_url": ...}, ...}
     """
     songs = {}
-    if not os.path.exists(SONGS_CSV):
+    if not os.path.exists(csv_path):
         return songs
-    with open(SONGS_CSV, newline="", encoding="utf-8") as f:
+    with open(csv_path, newline="", encoding="utf-8") as f:
         reader = csv.reader(f)
         for row in reader:
             if len(row) < 3:
                 continue
-            filename, display_name, spotify_url = row
+            filename, display_name, spotify_url = row[:3]
             filename = filename.strip()
             display_name = display_name.strip()
             spotify_url = spotify_url.strip()
@@ -25,24 +39,153 @@ def load_songs():
             songs[filename] = {"display_name": display_name, "spotify_url": spotify_url}
     return songs
 
-def add_song(filename, display_name, spotify_url):
+def _set_metadata(conn, filename, display_name, spotify_url, overwrite=False):
+    # Like the CSV before: the first display name of a song is kept, unless overwrite
+    condition = "" if overwrite else " AND display_name IS NULL"
+    c = conn.execute(f"""
+        UPDATE songs SET display_name = ?, spotify_url = ?
+        WHERE filename = ?{condition}""",
+        (display_name.strip() or None, spotify_url.strip(), filename.strip()))
+    return c.rowcount > 0
+
+def import_csv(db_file=DB_FILE, csv_path=SONGS_CSV, overwrite=False):
+    """
+    Copy display names and Spotify links from songs_db.csv into the songs
+    table. Returns (imported, skipped); rows of songs that are not indexed,
+    or already have a name and overwrite is False, are skipped.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        create_tables_and_indices(conn)
+        imported = skipped = 0
+        with conn:
+            for filename, info in read_csv(csv_path).items():
+                if _set_metadata(conn, filename, info["display_name"], info["spotify_url"], overwrite):
+                    imported += 1
+                else:
+                    skipped += 1
+            set_meta(conn, "songs_csv_imported", 1)
+            bump_counter(conn, "songs_version")
+    finally:
+        conn.close()
+    return imported, skipped
+
+def export_csv(db_file=DB_FILE, csv_path=SONGS_CSV):
     """
-    Add a song to the CSV database if it does not already exist.
+    Write the display names and Spotify links of all named songs to a CSV that
+    import_csv() reads back, e.g. to edit them or carry them over to a new
+    database. Returns the number of songs written.
     """
-    filename = filename.strip()
-    display_name = display_name.strip()
-    spotify_url = spotify_url.strip()
+    _prepare(db_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        rows = conn.execute("""
+            SELECT filename, display_name, spotify_url FROM songs
+            WHERE display_name IS NOT NULL OR spotify_url != ''
+            ORDER BY filename""").fetchall()
+    finally:
+        conn.close()
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        for filename, display_name, spotify_url in rows:
+            writer.writerow([filename, display_name or "", spotify_url or ""])
+    os.replace(tmp_path, csv_path)
+    return len(rows)
+
+def _prepare(db_file):
+    # Once per process and database: add the metadata columns and run the one-time CSV import
+    key = os.path.abspath(db_file)
+    with _cache_lock:
+        if key in _prepared:
+            return
+        conn = sqlite3.connect(db_file)
+        try:
+            create_tables_and_indices(conn)
+            done = get_meta(conn, "songs_csv_imported") is not None
+        finally:
+            conn.close()
+        if not done:
+            imported, skipped = import_csv(db_file)
+            if imported or skipped:
+                print(f"[songs_db] Imported metadata of {imported} songs from {SONGS_CSV} ({skipped} rows skipped)")
+        _prepared.add(key)
+
+def _song_info(row):
+    if row is None:
+        return {}
+    display_name, spotify_url, duration, fingerprint_count = row
+    info = {"spotify_url": spotify_url or "", "duration": duration, "fingerprint_count": fingerprint_count}
+    if display_name:
+        info["display_name"] = display_name
+    return info
+
+def get_song(filename, db_file=DB_FILE):
+    """
+    Metadata of one song by filename: {"display_name", "spotify_url", "duration",
+    "fingerprint_count"} ("display_name" only if set), {} for unknown songs.
+    """
+    _prepare(db_file)
+    key = os.path.abspath(db_file)
+    conn = acquire_read_connection(db_file)
+    try:
+        version = get_meta(conn, "songs_version", "0")
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is None or cached[0] != version:
+                cached = _cache[key] = (version, {})
+            if filename in cached[1]:
+                return dict(cached[1][filename])
+        # The UNIQUE constraint on filename is an index: one lookup, whatever the catalogue size
+        row = conn.execute("""
+            SELECT display_name, spotify_url, duration, fingerprint_count
+            FROM songs WHERE filename = ?""", (filename,)).fetchone()
+    finally:
+        release_read_connection(db_file, conn)
+    info = _song_info(row)
+    with _cache_lock:
+        cached[1][filename] = info
+    return dict(info)
+
+def add_song(filename, display_name, spotify_url, db_file=DB_FILE):
+    """
+    Set the display name and Spotify link of an indexed song if it has none yet.
+    Returns True if the song was updated.
+    """
+    _prepare(db_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        with conn:
+            updated = _set_metadata(conn, filename, display_name, spotify_url)
+            if updated:
+                bump_counter(conn, "songs_version")
+    finally:
+        conn.close()
+    return updated
+
+if __name__ == "__main__":
+    import argparse
 
-    exists = False
-    if os.path.exists(SONGS_CSV):
-        with open(SONGS_CSV, newline="", encoding="utf-8") as f:
-            for row in csv.reader(f):
-                # Compare stripped filenames (robust)
-                if row and row[0].strip() == filename:
-                    exists = True
-                    break
+    parser = argparse.ArgumentParser(description="Song metadata stored in the fingerprint database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    importing = sub.add_parser("import", help="Copy display names and Spotify links from the CSV into the database")
+    importing.add_argument("--db", default=DB_FILE)
+    importing.add_argument("--csv", default=SONGS_CSV)
+    importing.add_argument("--keep-existing", action="store_true",
+                           help="Only name songs that have no display name yet")
+    exporting = sub.add_parser("export", help="Write display names and Spotify links from the database to the CSV")
+    exporting.add_argument("--db", default=DB_FILE)
+    exporting.add_argument("--csv", default=SONGS_CSV)
+    args = parser.parse_args()
 
-    if not exists:
-        with open(SONGS_CSV, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
-            writer.writerow([filename, display_name, spotify_url])
+    if not os.path.exists(args.db):
+        print(f"Database '{args.db}' does not exist!")
+    elif args.command == "import":
+        if not os.path.exists(args.csv):
+            print(f"CSV file '{args.csv}' does not exist!")
+        else:
+            imported, skipped = import_csv(args.db, args.csv, overwrite=not args.keep_existing)
+            print(f"Imported metadata of {imported} songs ({skipped} rows skipped).")
+    elif args.command == "export":
+        n = export_csv(args.db, args.csv)
+        print(f"Exported metadata of {n} songs to '{args.csv}'.")
@@ -1,7 +1,8 @@
-import csv
-import os
 import re
-import lyricsgenius
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 GENIUS_TOKEN = "your_actual_genius_api_token_here"
@@ -34,16 +35,128 @@ def clean_lyrics(lyrics, title):
         lines = lines[1:]
     return "\n".join(lines)
 
-genius = lyricsgenius.Genius(GENIUS_TOKEN, skip_non_songs=True, excluded_terms=["(Remix)", "(Live)"], remove_section_headers=True, timeout=10)
+# The Genius client (and lyricsgenius with its requests/bs4 stack) is only
+# created when lyrics are fetched for the first time, not when the app starts
+_genius = None
+_genius_lock = threading.Lock()
+
+def get_genius_client():
+    global _genius
+    with _genius_lock:
+        if _genius is None:
+            import lyricsgenius
+            _genius = lyricsgenius.Genius(GENIUS_TOKEN, skip_non_songs=True, excluded_terms=["(Remix)", "(Live)"], remove_section_headers=True, timeout=10)
+        return _genius
+
+# === Fetch backends ===
+# A backend is a callable backend(artist, title) -> lyrics text, or None when the
+# song has no lyrics; it raises on network/API errors. Swap it with set_lyrics_backend().
+class GeniusBackend:
+    def __call__(self, artist, title):
+        song = get_genius_client().search_song(title, artist)
+        return song.lyrics if song and song.lyrics else None
+
+_backend = GeniusBackend()
+
+def set_lyrics_backend(backend):
+    global _backend
+    _backend = backend
+
+# === Persistent cache ===
+# One row per (artist, title), also for songs without lyrics (lyrics NULL), so
+# a miss is not searched again on every click. Errors are never cached.
+LYRICS_CACHE_DB = "lyrics_cache.db"
+LYRICS_TTL = 30 * 24 * 3600         # seconds a found text stays valid
+LYRICS_NEGATIVE_TTL = 24 * 3600     # seconds "no lyrics" stays valid
+
+def _cache_key(artist, title):
+    return artist.strip().lower(), title.strip().lower()
+
+def _open_cache():
+    conn = sqlite3.connect(LYRICS_CACHE_DB, timeout=10)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lyrics (
+            artist TEXT,
+            title TEXT,
+            lyrics TEXT,
+            fetched_at REAL,
+            PRIMARY KEY (artist, title)
+        ) WITHOUT ROWID;
+        """)
+    return conn
+
+def _cached_lyrics(artist, title):
+    # (True, lyrics or None) for a fresh entry, (False, None) otherwise
+    conn = _open_cache()
+    try:
+        row = conn.execute("SELECT lyrics, fetched_at FROM lyrics WHERE artist=? AND title=?",
+                           _cache_key(artist, title)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return False, None
+    lyrics, fetched_at = row
+    ttl = LYRICS_TTL if lyrics is not None else LYRICS_NEGATIVE_TTL
+    if time.time() - fetched_at > ttl:
+        return False, None
+    return True, lyrics
+
+def _store_lyrics(artist, title, lyrics):
+    conn = _open_cache()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO lyrics (artist, title, lyrics, fetched_at) VALUES (?, ?, ?, ?)",
+                         (*_cache_key(artist, title), lyrics, time.time()))
+    finally:
+        conn.close()
+
+def get_lyrics(artist, title):
+    """Cleaned lyrics, or None if the song has none. Served from the cache while fresh; raises on fetch errors."""
+    found, lyrics = _cached_lyrics(artist, title)
+    if found:
+        return lyrics
+    lyrics = _backend(artist, title)
+    if lyrics is not None:
+        lyrics = clean_lyrics(lyrics, title)
+    _store_lyrics(artist, title, lyrics)
+    return lyrics
+
+# === Background prefetch ===
+# recognize() -> prefetch_lyrics(): the search runs while the result page is drawn
+_prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lyrics-prefetch")
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def prefetch_lyrics(artist, title):
+    # Same as fetch_lyrics_genius(): without a token there is nothing to search
+    if not GENIUS_TOKEN:
+        return None
+    key = _cache_key(artist, title)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        started = future is None
+        if started:
+            future = _in_flight[key] = _prefetch_pool.submit(get_lyrics, artist, title)
+    if started:
+        # Outside the lock: the callback runs right away if the fetch is already done
+        future.add_done_callback(lambda _: _forget_in_flight(key))
+    return future
+
+def _forget_in_flight(key):
+    with _in_flight_lock:
+        _in_flight.pop(key, None)
 
 def fetch_lyrics_genius(artist, title):
     if not GENIUS_TOKEN:
         return "Genius API token is missing. Please set GENIUS_API_TOKEN in .env"
 
     try:
-        song = genius.search_song(title, artist)
-        if song and song.lyrics:
-            return clean_lyrics(song.lyrics, title)
+        # Join a prefetch that is still running instead of searching twice
+        with _in_flight_lock:
+            future = _in_flight.get(_cache_key(artist, title))
+        lyrics = future.result() if future is not None else get_lyrics(artist, title)
+        if lyrics:
+            return lyrics
         else:
             return "Lyrics not found on Genius."
     except Exception as e: